@@ -0,0 +1,152 @@
+import pandas as pd
+import numpy as np
+import datetime as dt
+import io
+import os
+from functools import cached_property
+from errors import CalendarError
+
+class PICalendar:
+    """PI and sprint dates, read once per process and shared by every Pivot
+
+    The PI Lookup and Sprints files can be paths, bytes of an xlsx file or
+    DataFrames. A calendar keeps the frames it has read, so make a new one
+    to pick up edited files.
+    """
+    # Parsed files by path and read options, with the modified time and size
+    # they were read at, shared by all calendars in the process
+    _files = {}
+
+    def __init__(self, PILookupFile, sprintFile=None):
+        self.PILookupFile = PILookupFile
+        self.sprintFile = sprintFile
+        return
+
+    @classmethod
+    def read_file(cls, path, **kwargs):
+        """Read an excel file once per process, again if it has changed since
+
+        Returns a copy, so callers cannot change the shared frame.
+        """
+        if isinstance(path, pd.DataFrame):
+            return path.copy()
+        if isinstance(path, bytes):
+            return pd.read_excel(io.BytesIO(path), **kwargs)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        # Options such as parse_dates can be lists, so key on their repr
+        key = (path, tuple(sorted((name, repr(value)) for name, value in kwargs.items())))
+        if cls._files.get(key, (None, None))[0] != stamp:
+            cls._files[key] = (stamp, pd.read_excel(path, **kwargs))
+        return cls._files[key][1].copy()
+
+    @staticmethod
+    def validate(df, name, idCol):
+        """Calendar frame with parsed dates. Raises if columns or dates are invalid"""
+        missing = [col for col in [idCol, 'Start', 'End'] if col not in df.columns]
+        if missing:
+            raise CalendarError(f"{name} file is missing columns {missing}.")
+        df = df.assign(Start=pd.to_datetime(df.Start, errors='coerce'),
+                       End=pd.to_datetime(df.End, errors='coerce'))
+        if df[['Start', 'End']].isna().any().any() | (df.Start > df.End).any():
+            raise CalendarError(f"{name} file has missing or reversed Start/End dates. " \
+                "Please check the file.")
+        return df
+
+    @staticmethod
+    def get_intervals(df):
+        return pd.IntervalIndex.from_arrays(df.Start, df.End, closed='both')
+
+    @cached_property
+    def PILookupDf(self):
+        df = self.read_file(self.PILookupFile,
+                            sheet_name='PI Lookup',
+                            parse_dates=['Start', 'End'])
+        return self.validate(df, 'PI Lookup', 'PI')
+
+    @cached_property
+    def sprintsDf(self):
+        df = self.read_file(self.sprintFile, header=0)
+        return self.validate(df, 'Sprints', 'Sprint')
+
+    @cached_property
+    def PIIntervals(self):
+        return self.get_intervals(self.PILookupDf)
+
+    @cached_property
+    def sprintIntervals(self):
+        return self.get_intervals(self.sprintsDf)
+
+    @cached_property
+    def PILookupHash(self):
+        """Content hash of the PI Lookup table, used for cache keys"""
+        return str(pd.util.hash_pandas_object(self.PILookupDf, index=False).sum())
+
+    @staticmethod
+    def lookup(intervals, values, dates):
+        """Label of the first interval containing each date, NaN if none"""
+        dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(dates), errors='coerce'))
+        if not intervals.is_overlapping:
+            pos = intervals.get_indexer(dates)
+        else:
+            # Overlapping intervals: earlier rows win, as in the lookup file order
+            pos = np.full(len(dates), -1)
+            for i in range(len(intervals) - 1, -1, -1):
+                inInterval = ((dates >= intervals.left[i])
+                              & (dates <= intervals.right[i]))
+                pos[inInterval] = i
+        result = pd.Series(values, dtype=object).reindex(pos).values
+        result[pos == -1] = np.nan
+        return result
+
+    def get_PI(self, dates):
+        """PI for each date, e.g. 'PI 23.2'"""
+        return self.lookup(self.PIIntervals, self.PILookupDf.PI.values, dates)
+
+    def get_sprint(self, dates):
+        """Sprint for each date, e.g. '23.2.3'"""
+        return self.lookup(self.sprintIntervals, self.sprintsDf.Sprint.values, dates)
+
+    def get_PI_sprints(self, PI):
+        """Sprint rows (Sprint, Start, End) that belong to a PI, e.g. '23.2'"""
+        PI = PI.replace('PI ', '')
+        sprints = self.sprintsDf
+        return sprints[sprints.Sprint.astype(str).str.startswith(f"{PI}.")]
+
+    def get_PI_sprint_count(self, PI):
+        """Number of sprints in a PI, None without a Sprints file or if the PI is not in it"""
+        if self.sprintFile is None:
+            return None
+        return len(self.get_PI_sprints(PI)) or None
+
+    def get_current_sprint(self, today=None):
+        """Current sprint, last complete sprint and PI based on today's date"""
+        sprints = self.sprintsDf
+        if today is None:
+            today = dt.datetime.today()
+        today = dt.datetime.combine(today.date(), dt.time())
+
+        # get most recent tuesday
+        todayDay = today.weekday()
+        if todayDay < 1:
+            # it is monday
+            lastTuesday = today - dt.timedelta(days=6)
+        else:
+            # it is not monday
+            lastTuesday = today - dt.timedelta(days=todayDay+1)
+        PISprint = sprints[((lastTuesday > sprints.Start)
+                            & (lastTuesday <= sprints.End))].iloc[0].Sprint
+        curSprint = PISprint.split('.')[-1]
+        if curSprint == "IP":
+            curSprint = 6
+
+        # Get last completed sprint
+        PISprint = sprints[(today > sprints.End)].iloc[-1].Sprint
+        if curSprint == 1:
+            lastCompleteSprint = 0
+        else:
+            lastCompleteSprint = PISprint.split('.')[-1]
+            if lastCompleteSprint == "IP":
+                lastCompleteSprint = 6
+        PI = '.'.join(PISprint.split('.')[:2])
+        return int(curSprint), int(lastCompleteSprint), PI
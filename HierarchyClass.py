@@ -0,0 +1,55 @@
+import pandas as pd
+import numpy as np
+
+class HierarchyTree:
+    """Dotted Jira Index column (e.g. '1.2.3') parsed once into a tree
+
+    Every distinct Index is a node. For each row the tree stores its node id,
+    depth and the ancestor node at each level, so values can be
+    copied down the hierarchy with array indexing instead of string splits.
+    """
+    def __init__(self, index):
+        index = pd.Series(index)
+        self.rowIndex = index.index
+        parts = index.str.split('.', expand=True)
+
+        # Node ids, one per distinct Index
+        self.nodeIds, self.nodes = pd.factorize(index)
+        self.depth = parts.notna().sum(axis=1).values
+        self.maxDepth = parts.shape[1]
+
+        # Index of the ancestor at each level. Rows above a level are their
+        # own ancestor at that level, e.g. '1.2' at level 3 is '1.2'
+        prefix = parts[0]
+        prefixes = [prefix]
+        for level in range(1, self.maxDepth):
+            prefix = (prefix + '.' + parts[level]).fillna(prefix)
+            prefixes.append(prefix)
+        nodeIndex = pd.Index(self.nodes)
+        self.ancestors = np.vstack([nodeIndex.get_indexer(prefix) for prefix in prefixes])
+        return
+
+    def get_ancestor(self, level):
+        """Node id of each row's ancestor at level (1 is the top level)"""
+        if level > self.maxDepth:
+            return self.nodeIds
+        return self.ancestors[level - 1]
+
+    def gather(self, values, filterCondition, level, fillNA=np.nan):
+        """Copy values of the filtered rows down to their descendants
+
+        Each row gets the value of its ancestor at level, if that ancestor is
+        one of the filtered rows. When an Index appears more than once, the
+        last filtered row wins.
+        """
+        values = np.asarray(values, dtype=object)
+        filterCondition = np.asarray(filterCondition, dtype=bool) & (self.nodeIds != -1)
+
+        nodeValues = np.full(len(self.nodes) + 1, np.nan, dtype=object)
+        filteredIds = self.nodeIds[filterCondition]
+        last = ~pd.Series(filteredIds).duplicated(keep='last').values
+        nodeValues[filteredIds[last]] = values[filterCondition][last]
+
+        # Ancestors missing from the tree map to the trailing NaN slot
+        newSeries = pd.Series(nodeValues[self.get_ancestor(level)], index=self.rowIndex)
+        return newSeries.fillna(fillNA)
@@ -1,121 +1,46 @@
 import os
-import regex as re
-import pandas as pd
 import datetime as dt
-import xlsxwriter
 import argparse
 import sys
-from PivotClass import Pivot
+import shutil
+import profiler
+
+# pandas, xlsxwriter, regex and the Report class are imported inside main,
+# so argument parsing starts quickly
 
 def main(curSprint, lastCompleteSprint, PI,
         newJiraFile, prevJiraFile, baseJiraFile, 
         stoplightWdir, PILookupFile,
-        printContributors):
+        printContributors, cacheDir=None, calendar=None,
+        compact=None, jobs=1, streamExport=None, thresholds=None,
+        profile=None, allSprints=None, PIs=None):
+    from ReportClass import Report
+    from errors import StoplightError
 
     # Directory where two excel files will be output
     stoplightDir = os.path.join(stoplightWdir, 
                                 f'Stoplight_{dt.datetime.now().strftime("%y%m%d_%H%M%S")}')
     if not os.path.exists(stoplightDir):
         os.makedirs(stoplightDir)
-        
-    # Get all data
-    # Epics
-    # epics = ['ACE-1 CLIN 2013: Maps', 
-    #          'ACE-1 CLIN 2013: Rapid Adaptive Planning (RAP)',
-    #         'ACE-1 CLIN 2013: RAPSAW SEIT',
-    #         'ACE-1 CLIN 2013: Resource Deconf. (RD) / Resource Viewer (RV)',
-    #         'ACE-1 CLIN 2016: CSS HW Engineering',
-    #         'ACE-1 CLIN 2016: ESS Solution',
-    #         'ACE-1 CLIN 2016: Multi-Factor Authentication (MFA) Solution',
-    #         'ACE-1 CLIN 2016: SEIT',
-    #         'ACE-1 CLIN 2016: SIEM and IDS',
-    #         'ACE-1 CLIN 2018: CAMD',
-    #         'ACE-1 CLIN 2018: CSS Extension',
-    #         'ACE-1 CLIN 2018: DevEnv Products',
-    #         'ACE-1 CLIN 2018: DevSecOps',
-    #         'ACE-1 CLIN 2018: EA SEIT',
-    #         'ACE-1 CLIN 2018: Enterprise Architecture HW Engineering'
-    #         ]
-    epics = [
-            'ACE-1 CLIN 2013: LAE BCB-1505',
-            'ACE-1 CLIN 2013: Rapid Adaptive Planning (RAP)',
-            'ACE-1 CLIN 2013: RAPSAW SEIT',
-            'ACE-1 CLIN 2013: Resource Deconf. (RD) / Resource Viewer (RV)',
-            'ACE-1 CLIN 2016: CSS HW Engineering',
-            'ACE-1 CLIN 2016: ESS Solution',
-            'ACE-1 CLIN 2016: Multi-Factor Authentication (MFA) Solution',
-            'ACE-1 CLIN 2016: SEIT',
-            'ACE-1 CLIN 2016: SIEM and IDS',
-            'ACE-1 CLIN 2018: CAMD',
-            'ACE-1 CLIN 2018: CSS Extension',
-            'ACE-1 CLIN 2018: DevEnv Products',
-            'ACE-1 CLIN 2018: DevSecOps',
-            'ACE-1 CLIN 2018: EA SEIT',
-            'ACE-1 CLIN 2018: Enterprise Architecture HW Engineering'
-            ]
-    
-    # Clins
-    clinPattern = re.compile("CLIN \d{4}")
-    clins = sorted(list(set([re.search(clinPattern, epic).group() for epic in epics])))
-
-    # Instantiate pivots from current, previous, baseline weeks
-    cur = Pivot(newJiraFile, PILookupFile, epics, clins, PI, jira="Current", stoplightDir=stoplightDir)
-    prev = Pivot(prevJiraFile, PILookupFile, epics, clins, PI, jira="Previous", stoplightDir=stoplightDir)
-    baseline = Pivot(baseJiraFile, PILookupFile, epics, clins, PI, jira="Baseline", stoplightDir=stoplightDir)
-
-    if printContributors is not None:
-        for pivot in [cur, prev, baseline]:
-            pivot.pivotDf.to_excel(os.path.join(stoplightDir, f"{pivot.jira}Contributors.xlsx"), index=False)
-
-    # Set slips
-    cur.set_slip(prev.JiraDf, baseline.JiraDf)
-    prev.set_slip(prev.JiraDf, baseline.JiraDf)
-
-    # Set new stories
-    cur.set_new(prev.JiraDf, baseline.JiraDf)
 
-    # Set changes since last week
-    cur.set_weekly_change(prev.pivotTable)
-
-    # Set cumulative metrics
-    cur.set_cum_metrics()
-    prev.set_cum_metrics()
-    baseline.set_cum_metrics()
-
-    # Set sprint metrics
-    cur.set_sprint_metrics(curSprint, lastCompleteSprint,
-                            baseline.cumSum, baseline.cumPer)
-    prev.set_sprint_metrics(curSprint, lastCompleteSprint,
-                            baseline.cumSum, baseline.cumPer)
-    
-    # Write to excel
-    excelFile = os.path.join(stoplightDir,
-                             f'Ground_Dev_ART_STOPLIGHT_{dt.datetime.now().strftime("%y%m%d_%H%M%S")}.xlsx')
-    writer = pd.ExcelWriter(excelFile,
-                            engine='xlsxwriter')  
-    cur.excel_pivot(writer)
-    prev.excel_pivot(writer)
-    baseline.excel_pivot(writer)
-
-    cur.excel_Jira(writer)
-    prev.excel_Jira(writer, cur=cur)
-    baseline.excel_Jira(writer, cur=cur)
-    writer.book.close()
-
-    # Separate by CLIN
-    cur.stoplightDict = {}
-    for clin in clins:
-        cur.set_stoplight_data(baseline, clin)
-        cur.stoplightDict[clin] = {'Data': cur.stoplightData, 
-                                    'Change_BL': cur.changeBL}
-        
-    # Write to stoplight excel
-    stoplightFile = os.path.join(stoplightDir,
-                                  f'Stoplight_Graphics_{dt.datetime.now().strftime("%y%m%d_%H%M%S")}.xlsx')
-    wb = xlsxwriter.Workbook(stoplightFile)
-    for clin in clins:
-        cur.create_stoplight_sheet(wb, clin)
-    wb.close()
+    try:
+        report = Report(curSprint, lastCompleteSprint, PI,
+                        newJiraFile, prevJiraFile, baseJiraFile, PILookupFile,
+                        cacheDir=cacheDir, calendar=calendar, compact=compact,
+                        jobs=jobs, thresholds=thresholds, PIs=PIs)
+    except StoplightError:
+        # Don't leave an empty output directory behind
+        shutil.rmtree(stoplightDir)
+        raise
+
+    # Write to excel and stoplight excel
+    report.write(stoplightDir, printContributors, streamExport, jobs, allSprints)
+
+    if profile:
+        # Phases first, then each file written, then the stages of each pivot
+        profiler.write_report(report.profile, stoplightDir)
+        print(f"Wrote profile report to {stoplightDir}")
+    return report
 
 if __name__ == "__main__":
     # File that contains dates of sprints
@@ -124,40 +49,12 @@ if __name__ == "__main__":
     # Directory where stoplight files will be output
     defaultStoplightWdir = r"\\us.lmco.com\sscdfs\Deptdisk\v\vf_aehf\ACE-1 Execution\Stoplight Data Snapshots\Script\Stoplights"
 
-    # Get last completed sprint
-    sprintFile = r"\\us.lmco.com\sscdfs\Deptdisk\v\vf_aehf\ACE-1 Execution\Stoplight Data Snapshots\Script\Sprints.xlsx"
-    sprints = pd.read_excel(sprintFile, header=0)
-    today = dt.datetime.today()
-    
-    # Get current sprint
-    # get most recent tuesday
-    today = dt.datetime.strptime(dt.datetime.today().date().strftime('%Y-%m-%d %H:%M:%S'), 
-                                 '%Y-%m-%d %H:%M:%S')
-    todayDay = today.weekday()
-    if todayDay < 1:
-        # it is monday
-        lastTuesday = today - dt.timedelta(days=6)
-    else:
-        # it is not monday
-        lastTuesday = today - dt.timedelta(days=todayDay+1)
-    PISprint = sprints[((lastTuesday > sprints.Start) 
-                        & (lastTuesday <= sprints.End))].iloc[0].Sprint
-    curSprint = PISprint.split('.')[-1]
-    if curSprint == "IP":
-        curSprint = 6
+    # Local directory where parsed Jira exports are cached between runs
+    defaultCacheDir = os.path.join(os.path.expanduser('~'), '.stoplight_cache')
 
-    # Get last completed sprint
-    PISprint = sprints[(today > sprints.End)].iloc[-1].Sprint
-    if curSprint == 1:
-        lastCompleteSprint = 0
-    else:
-        lastCompleteSprint = PISprint.split('.')[-1]
-        if lastCompleteSprint == "IP":
-            lastCompleteSprint = 6
-    
-    curSprint = int(curSprint)
-    lastCompleteSprint = int(lastCompleteSprint)
-    PI = '.'.join(PISprint.split('.')[:2])
+    # File that contains dates of sprints, only read if --sprint, 
+    # --lastCompleteSprint or --PI are not input
+    sprintFile = r"\\us.lmco.com\sscdfs\Deptdisk\v\vf_aehf\ACE-1 Execution\Stoplight Data Snapshots\Script\Sprints.xlsx"
 
     description = ("A script that takes in the sprint number and the "
                    + "current, previous, and baseline Jira exports "
@@ -173,17 +70,14 @@ if __name__ == "__main__":
     parser.add_argument('baseJiraFile', 
                         help='Path to baseline Jira export')
     parser.add_argument('--sprint', 
-                        help='INT: Current sprint number', 
-                        type=int,
-                        default=curSprint)
+                        help='INT: Current sprint number. Default is found from the Sprints file', 
+                        type=int)
     parser.add_argument('--lastCompleteSprint', 
-                        help='INT: Last complete sprint number', 
-                        type=int,
-                        default=lastCompleteSprint)
+                        help='INT: Last complete sprint number. Default is found from the Sprints file', 
+                        type=int)
     parser.add_argument('--PI', 
-                        help='str: current PI', 
-                        type=str,
-                        default=PI)
+                        help='str: current PI. Default is found from the Sprints file', 
+                        type=str)
     parser.add_argument('--PILookupFile', 
                         help='Path to PI Lookup file with dates for each PI', 
                         default=defaultPILookupFile)
@@ -193,20 +87,78 @@ if __name__ == "__main__":
     parser.add_argument('--printContributors', 
                         help='Flag to print items that contributed to the pivots', 
                         action=argparse.BooleanOptionalAction)
+    parser.add_argument('--cacheDir', 
+                        help='Local directory where parsed Jira exports are cached', 
+                        default=defaultCacheDir)
+    parser.add_argument('--noCache', 
+                        help='Flag to parse the Jira exports without the cache', 
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--compact', 
+                        help='Flag to store the Jira data as categoricals to save memory', 
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--jobs', 
+                        help='INT: Number of processes used to load the three Jira exports and write the output workbooks', 
+                        type=int,
+                        default=1)
+    parser.add_argument('--streamExport', 
+                        help='Flag to write the Jira export sheets row by row in constant memory', 
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--yellowThreshold', 
+                        help='FLOAT: Actual minus baseline percentage at or below which a sprint is yellow', 
+                        type=float)
+    parser.add_argument('--redThreshold', 
+                        help='FLOAT: Actual minus baseline percentage at or below which a sprint is red', 
+                        type=float)
+    parser.add_argument('--profile', 
+                        help='Flag to write per-stage timing and memory to profile.json and profile.txt', 
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--allSprints', 
+                        help='Flag to add a sheet with the sprint metrics as of every sprint of the PI', 
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--PIs', 
+                        help='str: PIs to report on together, or "all" for every PI in the current export', 
+                        nargs='+')
     args = parser.parse_args()
     
     # Check if --sprint was input but --lastCompleteSprint was not
-    if ('--sprint' in ''.join(sys.argv)) & ('--lastCompleteSprint' not in ''.join(sys.argv)):
+    if (args.sprint is not None) & (args.lastCompleteSprint is None):
         print("--sprint was input but --lastCompleteSprint was not. \
               \nIf --sprint is input, --lastCompleteSprint must also be input. Now exiting...")
         sys.exit()
 
-    data = main(args.sprint, 
-                args.lastCompleteSprint, 
-                args.PI, 
-                args.newJiraFile.strip('"'), 
-                args.prevJiraFile.strip('"'),
-                args.baseJiraFile.strip('"'),
-                args.stoplightWdir.strip('"'), 
-                args.PILookupFile.strip('"'),
-                args.printContributors)
+    from errors import StoplightError
+    try:
+        # Get current sprint, last completed sprint and PI from today's date
+        calendar = None
+        if None in (args.sprint, args.lastCompleteSprint, args.PI):
+            from CalendarClass import PICalendar
+            calendar = PICalendar(args.PILookupFile.strip('"'), sprintFile)
+            curSprint, lastCompleteSprint, PI = calendar.get_current_sprint()
+            if args.sprint is None:
+                args.sprint = curSprint
+            if args.lastCompleteSprint is None:
+                args.lastCompleteSprint = lastCompleteSprint
+            if args.PI is None:
+                args.PI = PI
+
+        data = main(args.sprint, 
+                    args.lastCompleteSprint, 
+                    args.PI, 
+                    args.newJiraFile.strip('"'), 
+                    args.prevJiraFile.strip('"'),
+                    args.baseJiraFile.strip('"'),
+                    args.stoplightWdir.strip('"'), 
+                    args.PILookupFile.strip('"'),
+                    args.printContributors,
+                    None if args.noCache else args.cacheDir.strip('"'),
+                    calendar,
+                    args.compact,
+                    args.jobs,
+                    args.streamExport,
+                    (args.yellowThreshold, args.redThreshold),
+                    args.profile,
+                    args.allSprints,
+                    args.PIs)
+    except StoplightError as error:
+        print(f"{error} Now exiting...")
+        sys.exit()
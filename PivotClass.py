@@ -1,43 +1,113 @@
 import pandas as pd
 import numpy as np
-import sys
-import re
-import shutil
-import os
-import string
+import io
+import copy
+import datetime as dt
 from format import formats
+import cache
+import profiler
+from profiler import profile_stage
+from CalendarClass import PICalendar
+from HierarchyClass import HierarchyTree
+from SchemaClass import ColumnSchema
+import forecast
+from errors import EmptyExportError, InvalidIndexError, InvalidDateError
+
+def get_sheet_rows(ws):
+    """Rows written to an xlsxwriter worksheet"""
+    return 0 if ws.dim_rowmax is None else ws.dim_rowmax + 1
 
 class Pivot:
-    def exit(self):
-        if os.path.exists(self.stoplightDir):
-            shutil.rmtree(self.stoplightDir)
-        sys.exit()
-    def __init__(self, jiraFile, PILookupFile, epics, clins, PI, jira, stoplightDir):
-        self.JiraDf = pd.read_excel(jiraFile, usecols='A:P')
+    # Low-cardinality columns stored as shared categoricals by compact()
+    compactCols = ['Epic', 'Capability', 'Feature', 'Team', 'Level',
+                   'PI', 'PI-Sprint', 'Issue Type']
+
+    # Columns of sprintMetrics and remainingSprintMetrics
+    sprintMetricCols = ['Current Total Pts', 'Change Since BL', 'Points Expected',
+                        'Points Completed', 'Delta Points', 'Current Completed']
+    remainingMetricCols = ['Points Remaining', 'Velocity', 'Sprints Remaining']
+
+    # Sprints in a PI, including the IP sprint, when there is no Sprints file
+    sprintsPerPI = 6
+
+    # Monte Carlo forecast trials, sprints looked ahead and random seed
+    forecastTrials = 10000
+    forecastHorizon = 60
+    forecastSeed = 0
+
+    # Default (yellow, red) stoplight thresholds for actual minus baseline
+    stoplightThresholds = (-0.05, -0.1)
+
+    def __init__(self, jiraFile, PILookupFile, epics, clins, PI, jira, stoplightDir=None,
+                 cacheDir=None, calendar=None):
+        """jiraFile and PILookupFile can be paths, bytes of an xlsx file or DataFrames"""
+        # Stage timings recorded by profile_stage
+        self.profile = []
         self.stoplightDir = stoplightDir
-
-        # Check if Jira file is empty. If yes, quit
-        if self.JiraDf.size == 0:
-            print(f"{jira} Jira file is empty. Please check the export file. " \
-                    "Now exiting...")
-            if os.path.exists(self.stoplightDir):
-                shutil.rmtree(self.stoplightDir)
-            sys.exit()
-        self.PILookupDf = pd.read_excel(PILookupFile, 
-                                        sheet_name = 'PI Lookup', 
-                                        parse_dates=['Start', 'End'])
         self.epics = epics
         self.clins = clins
+        # CLIN of each epic, computed once for every CLIN rollup
+        self.epicClins = self.get_epic_clins(epics, clins)
+        self.clinPositions = {clin: np.flatnonzero(self.epicClins == clin) 
+                              for clin in clins}
         self.PI = PI
         self.jira = jira
+        # Added to the PI's sheet names when several PIs share a workbook
+        self.sheetSuffix = ''
         self.sheetPivot = f"{self.jira} Pivot"
         self.sheetJira = f"{self.jira} Jira Export"
+        # PI dates are shared between pivots so the lookup file is read once
+        if calendar is None:
+            calendar = PICalendar(PILookupFile)
+        self.calendar = calendar
+        self.PILookupDf = calendar.PILookupDf
+
+        # Reuse the derived frame if this export was processed before
+        rawKey = derivedKey = None
+        jiraHash = None if cacheDir is None else cache.source_hash(jiraFile)
+        if jiraHash is not None:
+            rawKey = cache.get_key(cache.CACHE_VERSION, jiraHash)
+            derivedKey = cache.get_key(cache.CACHE_VERSION, jiraHash,
+                                       calendar.PILookupHash)
+        self.JiraDf = None
+        if derivedKey is not None:
+            with profiler.stage(self.profile, 'Derived cache lookup', jira,
+                                lambda: profiler.get_export_rows(self)) as record:
+                self.JiraDf = cache.load(cacheDir, 'derived', derivedKey)
+                if self.JiraDf is not None:
+                    record['Stage'] = 'Read Jira export (derived cache hit)'
+        if self.JiraDf is None:
+            self.load_jira(jiraFile, cacheDir, rawKey)
+            self.clean_data()
+            self.set_attributes()
+            cache.save(cacheDir, 'derived', derivedKey, self.JiraDf)
 
-        self.clean_data()
-        self.set_attributes()
         self.pivotTable = self.get_pivot()
         return
     
+    def load_jira(self, jiraFile, cacheDir=None, rawKey=None):
+        """Read the Jira export, from the cache if available"""
+        with profiler.stage(self.profile, 'Read Jira export', self.jira,
+                            lambda: profiler.get_export_rows(self)) as record:
+            self.JiraDf = cache.load(cacheDir, 'raw', rawKey)
+            if self.JiraDf is not None:
+                record['Stage'] = 'Read Jira export (raw cache hit)'
+                return
+            if isinstance(jiraFile, pd.DataFrame):
+                # Copy so the caller's frame is not changed
+                self.JiraDf = jiraFile.iloc[:, :16].copy()
+            else:
+                if isinstance(jiraFile, bytes):
+                    jiraFile = io.BytesIO(jiraFile)
+                self.JiraDf = pd.read_excel(jiraFile, usecols='A:P')
+            # Check if Jira file is empty
+            if self.JiraDf.size == 0:
+                raise EmptyExportError(f"{self.jira} Jira file is empty. " \
+                                       "Please check the export file.")
+            cache.save(cacheDir, 'raw', rawKey, self.JiraDf)
+        return
+
+    @profile_stage('clean_data')
     def clean_data(self):
         # Fill dates for start and end
         self.JiraDf['Planned Start Date'].fillna(method='pad', inplace=True)
@@ -47,6 +117,7 @@ class Pivot:
         self.JiraDf.loc[epic, 'Planned End Date'] = pd.NaT
         return
 
+    @profile_stage('set_attributes')
     def set_attributes(self, featureLevel=3):
         # Make sure all indexes are valid
         self.JiraDf.Index.apply(lambda x: self.testIndexes(x))
@@ -57,54 +128,31 @@ class Pivot:
         # Feature Level
         self.JiraDf['Feature Level'] = featureLevel
 
+        # Parse the Index column once into a tree for the level lookups below
+        tree = HierarchyTree(self.JiraDf.Index)
+        pcmCoolr = (self.JiraDf.Key.str[:9] == "pcmCoolr")
+
         # Epic
-        self.JiraDf['Epic'] = self.split_level(self.JiraDf, 
-                                               self.JiraDf['Issue Type'] == 'Portfolio Epic', 
-                                               lambda x: x[0], 
-                                               'No Epic')
+        self.JiraDf['Epic'] = tree.gather(self.JiraDf.Summary,
+                                          self.JiraDf['Issue Type'] == 'Portfolio Epic',
+                                          1,
+                                          'No Epic')
 
         # Capability
-        capabilityTemp = pd.DataFrame({'Index': self.JiraDf.Index,
-                                       'Summary':
-                                            self.split_level(self.JiraDf, 
-                                                            self.JiraDf.Key.apply(lambda x: x[:9]) == "pcmCoolr", 
-                                                            lambda x: '.'.join(x[:2]), 
-                                                            np.nan)})
-        capabilityFill = self.split_level(capabilityTemp, 
-                                          self.JiraDf.Key.apply(lambda x: x[:9]) == "pcmCoolr", 
-                                          lambda x: x[0], 
-                                          self.JiraDf.Summary)
-        capabilityTemp.Summary.fillna(capabilityFill, inplace=True)
-        self.JiraDf['Capability'] = capabilityTemp.Summary
+        capabilityTemp = tree.gather(self.JiraDf.Summary, pcmCoolr, 2)
+        capabilityFill = tree.gather(capabilityTemp, pcmCoolr, 1, self.JiraDf.Summary)
+        self.JiraDf['Capability'] = capabilityTemp.fillna(capabilityFill)
 
         # ID: Capability
-        idCapabilityTemp = pd.DataFrame({'Index': self.JiraDf.Index,
-                                         'Key':
-                                            self.split_level(self.JiraDf, 
-                                                            self.JiraDf.Key.apply(lambda x: x[:9]) == "pcmCoolr", 
-                                                            lambda x: '.'.join(x[:2]), 
-                                                            np.nan,
-                                                            split_by='Key')})
-        
-        idCapabilityFill = self.split_level(idCapabilityTemp, 
-                                            self.JiraDf.Key.apply(lambda x: x[:9]) == "pcmCoolr", 
-                                            lambda x: x[0], 
-                                            self.JiraDf.Key,
-                                            split_by='Key')
-        idCapabilityTemp.Key.fillna(idCapabilityFill, inplace=True)
-        self.JiraDf['ID: Capability'] = idCapabilityTemp.Key + ": " + self.JiraDf['Capability']
+        idCapabilityTemp = tree.gather(self.JiraDf.Key, pcmCoolr, 2)
+        idCapabilityFill = tree.gather(idCapabilityTemp, pcmCoolr, 1, self.JiraDf.Key)
+        idCapabilityTemp = idCapabilityTemp.fillna(idCapabilityFill)
+        self.JiraDf['ID: Capability'] = idCapabilityTemp + ": " + self.JiraDf['Capability']
 
         # Feature
-        featuresDf = self.JiraDf[self.JiraDf['Index Level'] == 3] [['Index', 'Key', 'Summary']]
-        featuresDf['feature'] = featuresDf.Key + ": " + featuresDf.Summary
-        featuresDict = (featuresDf
-                        .set_index('Index')
-                        .to_dict()['feature'])
-        self.JiraDf['Feature'] = (self.JiraDf.Index.str
-                                    .split('.')
-                                    .apply(lambda x: '.'.join(x[:3]))
-                                    .map(featuresDict)
-                                    .fillna(np.nan))
+        self.JiraDf['Feature'] = tree.gather(self.JiraDf.Key + ": " + self.JiraDf.Summary,
+                                             self.JiraDf['Index Level'] == 3,
+                                             3)
 
         self.JiraDf['Features'] = self.JiraDf['Key'] + ": " + self.JiraDf['Summary']
         self.JiraDf['Features'].where(self.JiraDf['Index Level'] == self.JiraDf['Feature Level'], 
@@ -114,202 +162,258 @@ class Pivot:
         self.JiraDf['PI Lookup'] = self.get_PILookup()
 
         # N-Sprint
+        sprint = self.JiraDf.Sprint.astype(str)
         self.JiraDf['N-Sprint'] = self.JiraDf.Sprint.str.count(',') + 1
 
-        # PI
-        self.JiraDf['PI'] = np.nan
-        definedSprint = (self.JiraDf['N-Sprint'] >= 1)
-        pattern = re.compile(r"PI \d{2}\.\d")
-        self.JiraDf.loc[definedSprint, 'PI'] = self.JiraDf.Sprint.apply(self.get_PI_sprint, 
-                                                                        args=(pattern,))
+        # PI (last PI listed in Sprint)
+        self.JiraDf['PI'] = self.extract_last(sprint, r"(PI \d{2}\.\d)")
         backlog = self.JiraDf.Sprint.str.startswith('Backlog').fillna(False)
-        self.JiraDf.loc[backlog, 'PI'] = ['Backlog'] * backlog.sum()
+        self.JiraDf.loc[backlog, 'PI'] = 'Backlog'
         self.JiraDf['PI'].fillna(self.JiraDf['PI Lookup'], inplace=True)
 
-        featurePI = self.split_level(self.JiraDf, 
-                                    self.JiraDf['Issue Type'] == 'Feature', 
-                                    lambda x: '.'.join(x[:3]), 
-                                    np.nan,
-                                    split_by='PI')
+        featurePI = tree.gather(self.JiraDf.PI, 
+                                self.JiraDf['Issue Type'] == 'Feature', 
+                                3)
         storyBeforeFeature = (self.JiraDf['PI'] < featurePI)
         notBacklog = (self.JiraDf['PI'] != "Backlog")
         self.JiraDf.loc[storyBeforeFeature & notBacklog, 'PI'] = featurePI[storyBeforeFeature & notBacklog]
 
         # Sprint Num
-        pattern = re.compile(r"PI \d{2}\.\d - S\d")
-        self.JiraDf['Sprint Num'] = self.JiraDf.Sprint.apply(self.get_PI_sprint, 
-                                                            args=(pattern, False,))
+        self.JiraDf['Sprint Num'] = self.extract_last(sprint, r"PI \d{2}\.\d - (S\d)")
         self.JiraDf.loc[storyBeforeFeature & notBacklog, 'Sprint Num'] = np.nan
 
         # PI-Sprint
-        pattern = re.compile(r"\d{2}\.\d")
-        pi = self.JiraDf.PI.apply(self.get_PI_sprint, args=(pattern, ))
+        pi = self.extract_last(self.JiraDf.PI, r"(\d{2}\.\d)")
         self.JiraDf['PI-Sprint'] = pi + "-" + self.JiraDf['Sprint Num'].fillna('')
-        self.JiraDf.loc[backlog, 'PI-Sprint'] = ['Backlog'] * backlog.sum()
+        self.JiraDf.loc[backlog, 'PI-Sprint'] = 'Backlog'
 
-        # Team
-        self.JiraDf['Team'] = self.JiraDf.Sprint.apply(self.get_team)
+        # Team (text after the last PCM_GD_ in Sprint)
+        self.JiraDf['Team'] = self.extract_last(sprint, r"PCM_GD_(.*)")
 
         # Level
-        self.JiraDf["Level"] = np.nan
-        pcmCoolr = (self.JiraDf.Key.str.startswith('pcmCoolr'))
-        space = (self.JiraDf.Key.str.startswith('SPACE'))
-        team = (self.JiraDf.Key.str.count('_') > 1)
-        self.JiraDf.loc[pcmCoolr,"Level"] = 'Solution'
-        self.JiraDf.loc[space,"Level"] = 'Portfolio'
-        self.JiraDf.loc[team,"Level"] = 'Team'
-        self.JiraDf.Level.fillna('ART', inplace=True)
+        self.JiraDf["Level"] = 'ART'
+        self.JiraDf.loc[self.JiraDf.Key.str.startswith('pcmCoolr'), "Level"] = 'Solution'
+        self.JiraDf.loc[self.JiraDf.Key.str.startswith('SPACE'), "Level"] = 'Portfolio'
+        self.JiraDf.loc[self.JiraDf.Key.str.count('_') > 1, "Level"] = 'Team'
         return
 
+    @profile_stage('get_pivot', lambda self, df=None: len(
+        self.PIPositions.get(f"PI {self.PI}", [])) if df is None else len(df))
     def get_pivot(self, df=None):
         if df is None:
-            df = self.JiraDf
+            df = self.get_PI_frame()
         # Filters 
-        PIFilter = (df.PI == f"PI {self.PI}")
-        levelFilter = (df.Level == "Team")
-        issueTypeFilter = ((df['Issue Type'] == "Enabler") 
-                        | (df['Issue Type'] == "Story"))
-        epicFilter = df.Epic.apply(lambda x: x in self.epics)
+        PIFilter = self.match(df.PI, [f"PI {self.PI}"])
+        levelFilter = self.match(df.Level, ["Team"])
+        issueTypeFilter = self.match(df['Issue Type'], ["Enabler", "Story"])
+        epicFilter = self.match(df.Epic, self.epics)
         filters = (PIFilter & levelFilter & issueTypeFilter & epicFilter)
 
-        # Pivot table
-        dfFiltered = df.copy()
-        dfFiltered = dfFiltered[filters]
-        self.pivotDf = dfFiltered
+        # Only the filtered rows are copied
+        dfFiltered = df[filters]
         marginsName = 'Grand Total'
 
-        # If no stories have slipped, add row of 0s to prevent error
+        # If no stories have slipped, return a pivot of 0s
         if dfFiltered.shape[0] == 0:
-            dfFiltered.loc[0] = 0
-        dfFiltered['Σ Story Points'].fillna(0, inplace=True)
-
-        summaryPivot = dfFiltered.pivot_table(values='Σ Story Points', 
-                                                index='Epic', 
-                                                columns='PI-Sprint', 
-                                                aggfunc='sum',
-                                                margins=True,
-                                                margins_name=marginsName)
-
-        # Need to add epics that don't have slip points
-        for epic in self.epics:
-            if epic not in summaryPivot.index.values:
-                summaryPivot.loc[epic] = 0
-
-        pivotOrder = self.epics + [marginsName]
-        summaryPivot = summaryPivot.loc[pivotOrder, :].fillna(0)
+            self.pivotDf = pd.DataFrame(0, index=[0], columns=df.columns)
+            return pd.DataFrame(0, 
+                                index=pd.Index(self.epics + [marginsName], name='Epic'),
+                                columns=pd.Index([0, marginsName], name='PI-Sprint'))
+        points = dfFiltered['Σ Story Points'].astype('float64').fillna(0)
+        self.pivotDf = dfFiltered.assign(**{'Σ Story Points': points})
+
+        # Sum story points by epic and sprint
+        summaryPivot = (points
+                        .groupby([dfFiltered.Epic, dfFiltered['PI-Sprint']], observed=True)
+                        .sum()
+                        .unstack('PI-Sprint'))
+        summaryPivot.columns = summaryPivot.columns.astype(object)
+        summaryPivot[marginsName] = summaryPivot.sum(axis=1)
+
+        # Epics that don't have points are added as 0s
+        summaryPivot = summaryPivot.reindex(pd.Index(self.epics, name='Epic')).fillna(0)
+        summaryPivot.loc[marginsName] = summaryPivot.sum()
         return summaryPivot
 
+    @property
+    def PIPositions(self):
+        """Row positions in JiraDf of each PI, e.g. 'PI 23.2', grouped once"""
+        if getattr(self, '_PIPositions', None) is None:
+            self._PIPositions = self.JiraDf.groupby('PI', observed=True, sort=False).indices
+        return self._PIPositions
+
+    def get_PI_frame(self, PI=None):
+        """Rows of JiraDf in a PI, e.g. '23.2'. Default is this pivot's PI"""
+        PI = self.PI if PI is None else PI
+        return self.JiraDf.iloc[self.PIPositions.get(f"PI {PI}", [])]
+
+    def get_PIs(self):
+        """PIs in the export, e.g. ['23.1', '23.2'], without Backlog"""
+        return sorted(str(PI).replace('PI ', '') for PI in self.PIPositions
+                      if str(PI).startswith('PI '))
+
+    def for_PI(self, PI, sheetSuffix=''):
+        """Pivot of another PI that shares this pivot's parsed export
+
+        JiraDf and its PI row positions are shared, not copied, so only the
+        pivot of the new PI is computed.
+        """
+        pivot = copy.copy(self)
+        pivot.PI = PI
+        pivot.profile = []
+        pivot.sheetSuffix = sheetSuffix
+        pivot.sheetPivot = f"{self.jira} Pivot{sheetSuffix}"
+        pivot.pivotTable = pivot.get_pivot()
+        return pivot
+
+    def fill_sprints(self, columns):
+        """Give a pivot without stories in the PI zero columns for each sprint"""
+        if self.columnSchema.sprintColumns.empty:
+            self.pivotTable = self.pivotTable.reindex(columns=list(columns) + ['Grand Total'],
+                                                      fill_value=0)
+        return
+
+    @classmethod
+    def get_categories(cls, pivots):
+        """Categories shared by the compact columns of several pivots"""
+        categories = {}
+        for col in cls.compactCols:
+            values = pd.concat([pivot.JiraDf[col] for pivot in pivots]).dropna().unique()
+            categories[col] = pd.CategoricalDtype(sorted(values, key=str))
+        return categories
+
+    def compact(self, categories):
+        """Store low-cardinality columns as categoricals and downcast numbers"""
+        for col, dtype in categories.items():
+            self.JiraDf[col] = self.JiraDf[col].astype(dtype)
+        self.JiraDf['Σ Story Points'] = pd.to_numeric(self.JiraDf['Σ Story Points'], 
+                                                      downcast='float')
+        self.JiraDf['Index Level'] = pd.to_numeric(self.JiraDf['Index Level'], 
+                                                   downcast='integer')
+        self.categories = categories
+        return
+
+    @staticmethod
+    def match(series, values):
+        """isin that compares integer codes when the column is categorical"""
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.categories.get_indexer(values)
+            return pd.Series(np.isin(series.cat.codes.values, codes[codes != -1]), 
+                             index=series.index)
+        return series.isin(values)
+
     def testIndexes(self, x):
         """Function to test if Index is valid"""
         if isinstance(x, float): 
-            print(f"Invalid Index: {x}. Please check the {self.jira} Jira " \
-                "export file for missing or extra rows and rerun. " \
-                    "Now exiting...")
-            if os.path.exists(self.stoplightDir):
-                shutil.rmtree(self.stoplightDir)
-            sys.exit()
-
-    def split_level(self, df, filterCondition, applyFunc, fillNA, split_by='Summary'):
-        """Function to split into levels by Summary""" 
-        featureDict = (df[filterCondition][['Index', split_by]]
-                        .set_index('Index')
-                        .to_dict()[split_by])
-        newSeries = (df.Index.str.split('.').apply(applyFunc)
-                    .map(featureDict)
-                    .fillna(fillNA))
-        return newSeries
-    
+            raise InvalidIndexError(f"Invalid Index: {x}. Please check the {self.jira} Jira " \
+                "export file for missing or extra rows and rerun.")
+
     def get_PILookup(self):
-        """Get PI dates from excel file"""
-        PILookup = {}
-        for idx, date in zip(self.JiraDf['Index'], self.JiraDf['Planned Start Date']):
-            if pd.isna(date):
-                PILookup[idx] = np.nan
-            elif isinstance(date, (float, int)):
-                print(f"Invalid PLanned Start Date: {date}. " \
+        """Get PI for each Planned Start Date from the PI calendar"""
+        dates = self.JiraDf['Planned Start Date']
+        # Numbers only show up in an object column, so skip the check otherwise
+        if not pd.api.types.is_datetime64_any_dtype(dates):
+            invalid = dates.apply(lambda x: isinstance(x, (float, int)) and not pd.isna(x))
+            if invalid.any():
+                raise InvalidDateError(f"Invalid PLanned Start Date: {dates[invalid].iloc[0]}. " \
                     f"Please check the {self.jira} Jira export file" \
-                    " for invalid dates. Now exiting...")   
-                if os.path.exists(self.stoplightDir):
-                    shutil.rmtree(self.stoplightDir) 
-                sys.exit()
-            else: 
-                for i in self.PILookupDf.index:
-                    if ((date >= self.PILookupDf.loc[i, 'Start']) 
-                        & (date <= self.PILookupDf.loc[i, 'End'])):
-                        PILookup[idx] = self.PILookupDf.loc[i, 'PI']
-                        break
-        return list(PILookup.values())
+                    " for invalid dates.")
+        return self.calendar.get_PI(dates)
     
-    def get_PI_sprint(self, string, pattern, PI=True):
-        matches = pattern.findall(str(string))
-        if not matches:
-            return np.nan
-        if PI:
-            return matches[-1]
-        else:
-            return matches[-1][-2:]
-        
-    def get_team(self, string):
-        match_idx = str(string).rfind("PCM_GD_")
-        if match_idx == -1:
-            return np.nan
-        return string[match_idx+7:]
-    
-    def set_slip(self, prevJiraDf, baselineDf):
+    @property
+    def columnSchema(self):
+        """Schema of the pivotTable columns, parsed again only when they change"""
+        schema = getattr(self, '_columnSchema', None)
+        if schema is None or not schema.columns.equals(self.pivotTable.columns):
+            schema = self._columnSchema = ColumnSchema(self.pivotTable.columns)
+        return schema
+
+    @staticmethod
+    def extract_last(series, pattern):
+        """Group of the last match of pattern in each value, NaN if no match"""
+        # A greedy prefix makes str.extract return the right-most match
+        return series.astype(str).str.extract(f"(?s).*{pattern}", expand=False)
+
+    @profile_stage('set_diff', lambda self, *args: len(self.diffDf))
+    def set_diff(self, prevJiraDf, baselineDf):
+        """Align this PI's current, previous and baseline stories on Key
+
+        diffDf has one row per Key with presence in each snapshot, a status,
+        story point changes and whether the story moved sprint or epic since
+        last week. Status is Present (in current and previous), Added (in
+        current, not previous) or Removed (not in current, so only in
+        previous or baseline). New flags added stories also missing from the
+        baseline, and
+        Slip Previous / Slip Baseline the removed stories that set_slip uses.
+        """
         # Only consider current PI stories
-        curDf = self.JiraDf[(self.JiraDf.PI == f"PI {self.PI}")]
-        prevJiraDf = prevJiraDf[(prevJiraDf.PI == f"PI {self.PI}")]
-        baselineDf = baselineDf[(baselineDf.PI == f"PI {self.PI}")]
-
-        # Keys in each df
-        curKey = curDf.Key
-        prevKey = prevJiraDf.Key
-        baseKey = baselineDf.Key
-
-        # Keys that have slipped from previous or baseline
-        prevSlip = prevJiraDf[(~prevKey.isin(curKey))]
-        baseSlip = baselineDf[(~baseKey.isin(curKey))]
-
-        # Start slip df with slips from previous Jira df
-        slipDf = prevSlip.copy()
-        # Add in slips from the baseline
-        for idx in baseSlip.index:
-            if baseSlip.loc[idx, 'Key'] in prevSlip.Key.values:
-                continue
-            else:
-                slipDf = pd.concat((slipDf, 
-                                    pd.DataFrame(baseSlip.loc[idx]).transpose()), 
-                                    ignore_index=True)
-        self.slipDf = slipDf
+        PIName = f"PI {self.PI}"
+        self.diffFrames = {'Cur': self.get_PI_frame(),
+                           'Prev': prevJiraDf[self.match(prevJiraDf.PI, [PIName])],
+                           'BL': baselineDf[self.match(baselineDf.PI, [PIName])]}
+
+        cols = ['Σ Story Points', 'PI-Sprint', 'Epic']
+        diffDf = pd.concat([df.drop_duplicates('Key').set_index('Key')[cols].add_suffix(f' {name}')
+                            for name, df in self.diffFrames.items()], axis=1)
+        for name, df in self.diffFrames.items():
+            diffDf[f'In {name}'] = diffDf.index.isin(df.Key)
+        inCur, inPrev, inBL = diffDf['In Cur'], diffDf['In Prev'], diffDf['In BL']
+
+        # Status
+        diffDf['New'] = inCur & ~inPrev & ~inBL
+        diffDf['Slip Previous'] = inPrev & ~inCur
+        diffDf['Slip Baseline'] = inBL & ~inCur
+        diffDf['Status'] = np.select([~inCur, ~inPrev], ['Removed', 'Added'], 'Present')
+
+        # Story point changes, missing stories count as 0 points
+        points = diffDf[['Σ Story Points Cur', 'Σ Story Points Prev', 'Σ Story Points BL']].fillna(0)
+        diffDf['Points Change Since Last Week'] = points.iloc[:, 0] - points.iloc[:, 1]
+        diffDf['Points Change Since BL'] = points.iloc[:, 0] - points.iloc[:, 2]
+
+        # Sprint and epic moves since last week
+        diffDf['Sprint Moved'] = inCur & inPrev & (diffDf['PI-Sprint Cur'] != diffDf['PI-Sprint Prev'])
+        diffDf['Epic Moved'] = inCur & inPrev & (diffDf['Epic Cur'] != diffDf['Epic Prev'])
+        self.diffDf = diffDf
+        return
+
+    def get_diff_keys(self, column):
+        """Keys flagged in a boolean diffDf column"""
+        return self.diffDf.index[self.diffDf[column]]
+
+    @profile_stage('set_slip', lambda self, *args: len(self.slipDf))
+    def set_slip(self, prevJiraDf=None, baselineDf=None):
+        if prevJiraDf is not None:
+            self.set_diff(prevJiraDf, baselineDf)
+        prevDf = self.diffFrames['Prev']
+        baselineDf = self.diffFrames['BL']
+
+        # Slips from previous, then slips from baseline not already included
+        prevSlip = prevDf[prevDf.Key.isin(self.get_diff_keys('Slip Previous'))]
+        baseSlip = baselineDf[baselineDf.Key.isin(self.get_diff_keys('Slip Baseline'))]
+        baseOnlySlip = baseSlip[~baseSlip.Key.isin(prevSlip.Key)]
+
+        self.slipDf = pd.concat((prevSlip, baseOnlySlip), ignore_index=True)
         self.slipDfPrev = prevSlip
         self.slipDfBaseline = baseSlip
         self.slipPivotTable = self.get_pivot(df=self.slipDf)
         self.pivotTable['Slip'] = self.slipPivotTable['Grand Total']
         return
 
-    def set_new(self, prevJiraDf, baselineDf):
-        # Only consider current PI stories
-        curDf = self.JiraDf[(self.JiraDf.PI == f"PI {self.PI}")]
-        prevJiraDf = prevJiraDf[(prevJiraDf.PI == f"PI {self.PI}")]
-        baselineDf = baselineDf[(baselineDf.PI == f"PI {self.PI}")]
-
-        # Keys in each df
-        curKey = curDf.Key
-        prevKey = prevJiraDf.Key
-        baseKey = baselineDf.Key
-
+    @profile_stage('set_new', lambda self, *args: len(self.diffFrames['Cur']))
+    def set_new(self, prevJiraDf=None, baselineDf=None):
+        if prevJiraDf is not None:
+            self.set_diff(prevJiraDf, baselineDf)
         # New keys not in previous or baseline
-        new = curDf[(~curKey.isin(prevKey) & ~curKey.isin(baseKey))]
-        self.newDf = new
+        curDf = self.diffFrames['Cur']
+        self.newDf = curDf[curDf.Key.isin(self.get_diff_keys('New'))]
         return
 
+    @profile_stage('set_weekly_change', lambda self, *args: len(self.changesWeek))
     def set_weekly_change(self, prevPivot):
         # Changes since last week
-        pattern = re.compile(r'\d{2}\.\d-S\d')
         changesSinceLastWeek = self.pivotTable - prevPivot
-        cols = (changesSinceLastWeek.columns.to_series()
-                .apply(self.get_PI_sprint, args=(pattern,))
-                .dropna().values)
+        # Columns of both weeks, so parse the combined columns
+        cols = ColumnSchema(changesSinceLastWeek.columns).sprintColumns.values
         changesSinceLastWeek.loc[self.epics, 'Grand Total'] = changesSinceLastWeek.loc[self.epics,cols].sum(axis=1)
         cols = np.append(cols, ['Grand Total'])
         changesSinceLastWeek = changesSinceLastWeek.loc[self.epics, 
@@ -338,28 +442,35 @@ class Pivot:
         return cumPer
     
     @staticmethod
-    def get_clin(df, clin):
-        clinIdx = df.index.to_series().apply(lambda x: clin in x)
-        return df[clinIdx]
+    def get_epic_clins(epics, clins):
+        """Categorical of the first CLIN named in each epic, indexed by epic"""
+        epicClins = [next((clin for clin in clins if clin in epic), np.nan) 
+                     for epic in epics]
+        return pd.Series(pd.Categorical(epicClins, categories=clins), index=epics)
+
+    def get_clin(self, df, clin):
+        """Rows of df for a CLIN, df indexed by the epics or by the CLINs"""
+        if df.index.equals(self.epicClins.index):
+            return df.iloc[self.clinPositions[clin]]
+        return df.loc[[clin]]
     
-    def get_clinPer(self, clin):
+    def get_clin_per(self):
+        """Cumulative percentage of each CLIN, one row per CLIN"""
         # Only use assigned sprint columns, plus slip if applicable
-        curClin = self.get_clin(self.cumSum, clin)
+        total = self.cumSum.iloc[:, -1]
         if 'Slip' in self.pivotTable.columns:
-            curClinSlip = self.get_clin(self.pivotTable, clin).Slip
-            total = (curClin.iloc[:, -1] + curClinSlip).values.sum()
-        else:
-            total = curClin.iloc[:, -1].values.sum() 
-        clinPer = self.get_clin(self.cumSum, clin).sum() / total
+            total = total + self.pivotTable.Slip.loc[self.epics]
+        groups = self.epicClins.values
+        clinSum = self.cumSum.groupby(groups, observed=False).sum()
+        clinTotal = total.groupby(groups, observed=False).sum()
+        clinPer = clinSum.div(clinTotal, axis=0)
+        clinPer.index = list(self.clins)
         return clinPer
 
+    @profile_stage('set_cum_metrics', lambda self: len(self.cumSum))
     def set_cum_metrics(self):
         # Only use actual sprint data
-        pattern = re.compile(r'\d{2}\.\d-S\d')
-        cols = (self.pivotTable.columns
-                .to_series().apply(self.get_PI_sprint, 
-                                    args=(pattern,))
-                                    .dropna().values)
+        cols = self.columnSchema.sprintColumns
         pivotSprints = self.pivotTable.copy()
         pivotSprints = pivotSprints.loc[self.epics, cols]
         
@@ -370,82 +481,136 @@ class Pivot:
         self.cumPer = self.get_cumper()
         
         # CLIN breakout
-        CLINDf = pd.DataFrame()
-        for clin in self.clins:
-            clinPer = self.get_clinPer(clin)
-            CLINDf[clin] = clinPer
-        CLINDf = CLINDf.transpose()
-        self.clinDf = CLINDf
+        self.clinDf = self.get_clin_per()
         return
 
-    def set_sprint_metrics(self, curSprint, lastCompleteSprint,
-                            baselineCumSum, baselineCumPer):
-        # Set last complete sprint
-        self.curSprint = curSprint
-        self.lastCompleteSprint = lastCompleteSprint
+    @staticmethod
+    def get_sprint_values(values, schema, sprints):
+        """Column of values for each sprint number, as rows
+
+        values has one column per column of schema. Sprint 0 is all zeros
+        and a sprint without a column is NaN.
+        """
+        positions = np.array([schema.sprintPositions.get(sprint, -1) for sprint in sprints])
+        sprintValues = values[:, positions].T
+        sprintValues[positions == -1] = np.nan
+        sprintValues[sprints == 0] = 0
+        return sprintValues
+
+    def get_sprint_metrics_matrix(self, baselineCumSum, baselineCumPer):
+        """Sprint metrics as of every sprint of the PI in one pass
+
+        As of sprint s, s is the last complete sprint and s + 1 the current
+        sprint; sprint 0 is before any sprint is complete. Returns the sprint
+        numbers and a sprints x epics x metrics array, the metrics in
+        sprintMetricCols + remainingMetricCols order.
+        """
+        cumSchema = ColumnSchema(self.cumSum.columns)
+        sprints = np.array([0] + sorted(cumSchema.sprintPositions))
+        cumSum = self.cumSum.to_numpy(dtype=float)
 
         # Current total (Points in sprint plus slip)
-        cumSumTot = self.cumSum.iloc[:, -1].values 
-        slip = self.pivotTable.Slip.drop(['Grand Total'])
-        curTotal = cumSumTot + slip
-        
+        curTotal = cumSum[:, -1] + self.pivotTable.Slip.loc[self.epics].to_numpy(dtype=float)
+
         # Change since baseline
-        baselineTotal = baselineCumSum.iloc[:, -1].values
-        baselineChange = curTotal - baselineTotal
-        
-        # Points expected and comnpleted 
-        if lastCompleteSprint == 0:
-            pointsExpected = pd.Series(data=len(self.epics) * [0], index=self.epics)
-            pointsCompleted = pd.Series(data=len(self.epics) * [0], index=self.epics)
-        else:
-            # Points expected
-            lastPattern = re.compile(fr'\d\d\.\d-S{lastCompleteSprint}')
-            col = (baselineCumPer.columns.to_series()
-                .apply(self.get_PI_sprint, args=(lastPattern,))
-                .dropna().values[0])
-            pointsExpected = (baselineCumPer.loc[self.epics, col] * curTotal)
-        
-            # Points completed
-            col = (self.cumSum.columns.to_series()
-                .apply(self.get_PI_sprint, args=(lastPattern,))
-                .dropna().values[0])
-            pointsCompleted = self.cumSum.loc[self.epics, col]
-
-        # Current completed
-        curPattern = re.compile(fr'\d\d\.\d-S{curSprint}')
-        col = (self.cumSum.columns.to_series()
-            .apply(self.get_PI_sprint, args=(curPattern,))
-            .dropna().values[0])
-        curPointsCompleted = self.cumSum.loc[self.epics, col]
-        
-        # Delta
-        delta = pointsCompleted - pointsExpected
+        baselineChange = curTotal - baselineCumSum.iloc[:, -1].to_numpy(dtype=float)
 
-        # Points remaining
-        pointsRem = curTotal - pointsCompleted
+        # Points expected and completed, sprints x epics
+        baselinePer = self.get_sprint_values(baselineCumPer.loc[self.epics].to_numpy(dtype=float),
+                                             ColumnSchema(baselineCumPer.columns), sprints)
+        pointsExpected = baselinePer * curTotal
+        pointsCompleted = self.get_sprint_values(cumSum, cumSchema, sprints)
+        curPointsCompleted = self.get_sprint_values(cumSum, cumSchema, sprints + 1)
 
-        # Velocity
-        vel = pointsCompleted / lastCompleteSprint
+        delta = pointsCompleted - pointsExpected
+        pointsRem = curTotal - pointsCompleted
+        # Velocity is NaN at sprint 0 and sprints remaining NaN without velocity
+        vel = np.divide(pointsCompleted, sprints[:, None], out=np.full(pointsCompleted.shape, np.nan),
+                        where=sprints[:, None] > 0)
+        sprintsRem = np.divide(pointsRem, vel, out=np.full(pointsCompleted.shape, np.nan),
+                               where=vel > 0)
+
+        shape = pointsCompleted.shape
+        matrix = np.stack([np.broadcast_to(curTotal, shape),
+                           np.broadcast_to(baselineChange, shape),
+                           pointsExpected, pointsCompleted, delta, curPointsCompleted,
+                           pointsRem, vel, sprintsRem], axis=2)
+        return sprints, matrix
+
+    def get_sprint_metrics(self, lastCompleteSprint, curSprint=None):
+        """Sprint metrics and remaining sprint metrics frames as of a sprint"""
+        metrics = self.sprintMetricsMatrix[list(self.sprintMetricsSprints).index(lastCompleteSprint)]
+        # Before any sprint is complete the legacy frames had an unnamed index
+        index = pd.Index(self.epics, name=None if lastCompleteSprint == 0 else 'Epic')
+        sprintMetrics = pd.DataFrame(metrics[:, :len(self.sprintMetricCols)],
+                                     index=index, columns=self.sprintMetricCols)
+        remainingSprintMetrics = pd.DataFrame(metrics[:, len(self.sprintMetricCols):],
+                                              index=index, columns=self.remainingMetricCols)
+        if curSprint is not None:
+            # Current completed for a current sprint other than the next one
+            sprintMetrics['Current Completed'] = self.get_sprint_values(
+                self.cumSum.to_numpy(dtype=float), ColumnSchema(self.cumSum.columns),
+                np.array([curSprint]))[0]
+        return sprintMetrics, remainingSprintMetrics
+
+    def get_sprint_metrics_frame(self):
+        """Sprint metrics as of every sprint, one row per sprint and epic"""
+        sprints, matrix = self.sprintMetricsSprints, self.sprintMetricsMatrix
+        index = pd.MultiIndex.from_product([sprints, self.epics], names=['As Of Sprint', 'Epic'])
+        return pd.DataFrame(matrix.reshape(-1, matrix.shape[2]), index=index,
+                            columns=self.sprintMetricCols + self.remainingMetricCols)
+
+    def get_forecast(self, lastCompleteSprint, pointsRem):
+        """Monte Carlo forecast of each epic and CLIN finishing its remaining points
+
+        Each trial resamples the points completed in sprints 1 to
+        lastCompleteSprint. Returns the epic and CLIN frames with forecast.columns.
+        """
+        cumSchema = ColumnSchema(self.cumSum.columns)
+        sprints = np.arange(lastCompleteSprint + 1)
+        # Cumulative points completed by the end of each sprint, carried over
+        # sprints without a column
+        cumCompleted = pd.DataFrame(self.get_sprint_values(
+            self.cumSum.to_numpy(dtype=float), cumSchema, sprints)).ffill().to_numpy()
+        history = np.diff(cumCompleted, axis=0).T
+
+        groups = (np.asarray(self.epicClins, dtype=object)[:, None]
+                  == np.array(self.clins, dtype=object)).astype(float)
+        needed = forecast.sprints_needed(history, pointsRem, groups, self.forecastTrials,
+                                         self.forecastHorizon, self.forecastSeed)
+        # Sprints in the PI from the calendar, as the last ones may have no stories yet
+        numSprints = self.calendar.get_PI_sprint_count(self.PI) or self.sprintsPerPI
+        sprintsLeft = max(numSprints, max(cumSchema.sprintPositions, default=0)) - lastCompleteSprint
+        summary = forecast.summarize(needed, sprintsLeft)
+        epicForecast = pd.DataFrame(summary[:len(self.epics)], index=self.epics,
+                                    columns=forecast.columns)
+        clinForecast = pd.DataFrame(summary[len(self.epics):], index=list(self.clins),
+                                    columns=forecast.columns)
+        return epicForecast, clinForecast
+
+    @profile_stage('set_sprint_metrics', lambda self, *args: len(self.sprintMetrics))
+    def set_sprint_metrics(self, curSprint, lastCompleteSprint,
+                            baselineCumSum, baselineCumPer):
+        # Set last complete sprint
+        self.curSprint = curSprint
+        self.lastCompleteSprint = lastCompleteSprint
 
-        # Sprints left
-        sprintsRem = pointsRem / vel
-        
-        # Data frame
-        sprintMetricsDf = pd.DataFrame({'Current Total Pts': curTotal,
-                                        'Change Since BL': baselineChange,
-                                        'Points Expected': pointsExpected,
-                                        'Points Completed': pointsCompleted,
-                                        'Delta Points': delta,
-                                        'Current Completed': curPointsCompleted})
-        remainingSprintMetrics = pd.DataFrame({'Points Remaining': pointsRem,
-                                                'Velocity': vel, 
-                                                'Sprints Remaining': sprintsRem})
-        self.sprintMetrics = sprintMetricsDf
-        self.remainingSprintMetrics = remainingSprintMetrics
+        # Metrics as of every sprint, then the frames for the last complete one
+        self.sprintMetricsSprints, self.sprintMetricsMatrix = \
+            self.get_sprint_metrics_matrix(baselineCumSum, baselineCumPer)
+        self.sprintMetrics, remainingSprintMetrics = \
+            self.get_sprint_metrics(lastCompleteSprint, curSprint)
+
+        # Forecast columns after the single velocity estimate
+        epicForecast, self.clinForecast = self.get_forecast(
+            lastCompleteSprint, remainingSprintMetrics['Points Remaining'])
+        epicForecast.index = remainingSprintMetrics.index
+        self.remainingSprintMetrics = pd.concat((remainingSprintMetrics, epicForecast), axis=1)
         return
 
+    @profile_stage('excel_pivot', lambda self, writer: get_sheet_rows(writer.sheets[self.sheetPivot]))
     def excel_pivot(self, writer):
-        letters = string.ascii_uppercase
+        # Cells are addressed by 0-indexed (row, col) so tables can be any width
         wb = writer.book
 
         ws = wb.add_worksheet(self.sheetPivot)
@@ -455,9 +620,6 @@ class Pivot:
         numEpics = self.pivotTable.shape[0]
         numColsSum = self.pivotTable.shape[1]
         numColsCum = self.cumSum.shape[1]
-        
-        lastColSum = letters[numColsSum]
-        lastColCum = letters[numColsCum]
 
         cumSumStartRow = numEpics + 4
         self.cumSum.to_excel(writer, sheet_name=self.sheetPivot, 
@@ -475,52 +637,65 @@ class Pivot:
         # Pergentage format
         percentFormat = wb.add_format({'num_format': '0%'})
         
-        ws.conditional_format(f'B{cumPerStartRow+2}:{lastColCum}{cumPerStartRow+2+numEpics}', 
+        ws.conditional_format(cumPerStartRow+1, 1, cumPerStartRow+1+numEpics, numColsCum,
                                 {'type': 'no_errors',
                                 'format': percentFormat})
-        ws.conditional_format(f'B{clinStartRow+2}:{lastColCum}{clinStartRow+4}', 
+        ws.conditional_format(clinStartRow+1, 1, clinStartRow+self.clinDf.shape[0], numColsCum,
                                 {'type': 'no_errors',
                                 'format': percentFormat})
 
         # Extra tables
-        if (self.sheetPivot == 'Current Pivot') | (self.sheetPivot == 'Previous Pivot'):
+        if self.jira in ('Current', 'Previous'):
             numColsSprint = self.sprintMetrics.shape[1]
             numColsRem = self.remainingSprintMetrics.shape[1]
-            firstColChange = letters[numColsSum+2]
-            lastColSprint = letters[numColsSum+numColsSprint+2]
-            firstColRem = letters[numColsSum+numColsSprint+4]
-            lastColRem = letters[numColsSum+numColsSprint+numColsRem+3]
+            firstColChange = numColsSum+2
+            lastColSprint = numColsSum+numColsSprint+2
+            firstColRem = numColsSum+numColsSprint+4
+            lastColRem = numColsSum+numColsSprint+numColsRem+3
 
             # Sprint table and remaining table
-            ws.merge_range(f'{firstColChange}{cumPerStartRow}:{lastColSprint}{cumPerStartRow}',
+            ws.merge_range(cumPerStartRow-1, firstColChange, cumPerStartRow-1, lastColSprint,
                     f'Sprint {self.lastCompleteSprint}', titleFormat)
-            ws.merge_range(f'{firstColRem}{cumPerStartRow}:{lastColRem}{cumPerStartRow}',
+            ws.merge_range(cumPerStartRow-1, firstColRem, cumPerStartRow-1, lastColRem,
                     f'Sprint {self.lastCompleteSprint}', titleFormat)
             
             self.sprintMetrics.to_excel(writer, sheet_name=self.sheetPivot,
                                                 startrow=cumPerStartRow, startcol=numColsSum+2) 
             self.remainingSprintMetrics.to_excel(writer, sheet_name=self.sheetPivot,
                                                         startrow=cumPerStartRow, 
-                                                        startcol=numColsSum+numColsSprint+4,
+                                                        startcol=firstColRem,
                                                         index=False) 
             ws.set_column(numColsSum+2, numColsSum+2, 60)
 
             # Round format
+            colSprintsRem = firstColRem + self.remainingSprintMetrics.columns.get_loc('Sprints Remaining')
             roundFormat = wb.add_format({'num_format': '#,##0'})
-            ws.conditional_format(f'{letters[numColsSum+5]}{cumPerStartRow+2}:{letters[numColsSum+numColsSprint+numColsRem+2]}{cumPerStartRow+2+numEpics}',
+            ws.conditional_format(cumPerStartRow+1, numColsSum+5, 
+                                    cumPerStartRow+1+numEpics, colSprintsRem-1,
                                     {'type': 'no_errors',
                                     'format': roundFormat})
             round2Format = wb.add_format({'num_format': '#,##0.00'})
-            ws.conditional_format(f'{lastColRem}{cumPerStartRow+2}:{lastColRem}{cumPerStartRow+2+numEpics}',
+            ws.conditional_format(cumPerStartRow+1, colSprintsRem, 
+                                    cumPerStartRow+1+numEpics, colSprintsRem,
                                     {'type': 'no_errors',
                                     'format': round2Format})
+            # Forecast sprints and chance of finishing
+            ws.conditional_format(cumPerStartRow+1, colSprintsRem+1, 
+                                    cumPerStartRow+1+numEpics, lastColRem-1,
+                                    {'type': 'no_errors',
+                                    'format': roundFormat})
+            perFormat = wb.add_format({'num_format': '0%'})
+            ws.conditional_format(cumPerStartRow+1, lastColRem, 
+                                    cumPerStartRow+1+numEpics, lastColRem,
+                                    {'type': 'no_errors',
+                                    'format': perFormat})
 
             # Columnd widths
-            ws.set_column(numColsSum+3, numColsSum+numColsSprint+numColsRem+3, 18)
+            ws.set_column(numColsSum+3, lastColRem, 18)
 
-            if self.sheetPivot == 'Current Pivot':
+            if self.jira == 'Current':
                 numColsChange = self.changesWeek.shape[1]
-                lastColChange = letters[numColsSum+2+numColsChange]
+                lastColChange = numColsSum+2+numColsChange
                 # Changes since last week
                 self.changesWeek.to_excel(writer, 
                                         sheet_name=self.sheetPivot, 
@@ -528,13 +703,13 @@ class Pivot:
                                         startcol=numColsSum+2)  
                 
                 # Add header
-                ws.merge_range(f'{firstColChange}1:{lastColChange}1',
+                ws.merge_range(0, firstColChange, 0, lastColChange,
                             'Changes Since Last Week', titleFormat)
                 
                 # Add cell formatting to changes since last week
                 redFormat = wb.add_format(formats['redDelta'])
-                lastRow = self.changesWeek.shape[0] + 2
-                ws.conditional_format(f'{letters[numColsSum+3]}3:{lastColChange}{lastRow}', 
+                lastRow = self.changesWeek.shape[0] + 1
+                ws.conditional_format(2, numColsSum+3, lastRow, lastColChange, 
                                         {'type': 'cell',
                                         'criteria': '!=',
                                         'value': 0,
@@ -546,44 +721,125 @@ class Pivot:
         ws.set_column(1, numColsSum, 10, catFormat)
 
         # Merge and add headers
-        letters = string.ascii_uppercase
-        
-        ws.merge_range(f'A1:{lastColSum}1',
+        ws.merge_range(0, 0, 0, numColsSum,
                        'Sum of Story Points', titleFormat)
-        ws.merge_range(f'A{cumSumStartRow}:{lastColCum}{cumSumStartRow}',
+        ws.merge_range(cumSumStartRow-1, 0, cumSumStartRow-1, numColsCum,
                        'Cumulative', titleFormat)
-        ws.merge_range(f'A{cumPerStartRow}:{lastColCum}{cumPerStartRow}',
+        ws.merge_range(cumPerStartRow-1, 0, cumPerStartRow-1, numColsCum,
                        'Percentage', titleFormat)
         return
     
+    def get_key_rows(self, keys):
+        """Positions of the JiraDf rows whose Key is in keys"""
+        return np.flatnonzero(self.JiraDf.Key.isin(keys).values)
+
     def format_keys(self, keys, format, ws):
-        for row in range(self.JiraDf.shape[0]):
-            key = self.JiraDf.loc[row, 'Key']
-            if key in keys:
-                ws.conditional_format(f'B{row+2}', 
-                                        {'type': 'no_errors',
-                                        'format': format})
+        """Rewrite column B of the rows whose Key is in keys with format"""
+        rows = self.get_key_rows(keys)
+        for row, value in zip(rows, self.JiraDf.iloc[rows, 1]):
+            if pd.isna(value):
+                ws.write_blank(row+1, 1, None, format)
+            else:
+                ws.write(row+1, 1, value, format)
+        return
+
+    @staticmethod
+    def add_streaming_worksheet(wb, name):
+        """Add a constant_memory worksheet that writes each row to a temp file"""
+        # xlsxwriter decides constant_memory per worksheet when it is added,
+        # so only this sheet streams and the pivot sheets are unchanged
+        wb.constant_memory = True
+        try:
+            ws = wb.add_worksheet(name)
+        finally:
+            wb.constant_memory = False
+        return ws
+
+    def stream_Jira(self, wb, ws, highlightRows, highlightFormat, chunkSize=10000):
+        """Write JiraDf to a constant_memory worksheet in row order
+
+        Column B of highlightRows is written with highlightFormat as the row
+        is written, since streamed rows can't be changed afterwards.
+        """
+        # Same header and date formats as DataFrame.to_excel
+        headerFormat = wb.add_format({'bold': True, 'border': 1, 
+                                      'align': 'center', 'valign': 'top'})
+        datetimeFormat = wb.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'})
+        dateFormat = wb.add_format({'num_format': 'YYYY-MM-DD'})
+        ws.write_row(0, 0, self.JiraDf.columns, headerFormat)
+
+        highlightRows = set(highlightRows)
+        for start in range(0, self.JiraDf.shape[0], chunkSize):
+            chunk = self.JiraDf.iloc[start:start+chunkSize]
+            isna = chunk.isna().values
+            for i, values in enumerate(chunk.itertuples(index=False, name=None)):
+                row = start + i + 1
+                for col, value in enumerate(values):
+                    if isna[i, col]:
+                        continue
+                    if isinstance(value, dt.datetime):
+                        ws.write_datetime(row, col, value, datetimeFormat)
+                    elif isinstance(value, dt.date):
+                        ws.write_datetime(row, col, value, dateFormat)
+                    else:
+                        ws.write(row, col, value)
+                if start + i in highlightRows:
+                    if isna[i, 1]:
+                        ws.write_blank(row, 1, None, highlightFormat)
+                    else:
+                        ws.write(row, 1, values[1], highlightFormat)
         return
                 
-    def excel_Jira(self, writer, cur=None):
+    @profile_stage('excel_Jira', lambda self, writer, *args, **kwargs:
+                   get_sheet_rows(writer.sheets[self.sheetJira]))
+    def excel_Jira(self, writer, cur=None, streaming=False):
         wb = writer.book
 
-        self.JiraDf.to_excel(writer, sheet_name=self.sheetJira, index=False)   
-
-        ws = writer.sheets[self.sheetJira]
-        # Add conditional formatting for new and slips
+        # Formatting for new and slips
         if self.sheetJira == 'Current Jira Export':
-            newFormat = wb.add_format(formats['newStories'])
-            newStories = self.newDf.Key.values
-            self.format_keys(newStories, newFormat, ws)
+            keyFormat = wb.add_format(formats['newStories'])
+            keys = self.get_diff_keys('New')
         else:
-            slipFormat = wb.add_format(formats['slipStories'])
+            keyFormat = wb.add_format(formats['slipStories'])
             if self.sheetJira == 'Previous Jira Export':
-                slipStories = cur.slipDfPrev.Key.values
+                keys = cur.get_diff_keys('Slip Previous')
             else:
-                slipStories = cur.slipDfBaseline.Key.values
-            self.format_keys(slipStories, slipFormat, ws)
-        
+                keys = cur.get_diff_keys('Slip Baseline')
+
+        if streaming:
+            ws = self.add_streaming_worksheet(wb, self.sheetJira)
+            writer.sheets[self.sheetJira] = ws
+            self.stream_Jira(wb, ws, self.get_key_rows(keys), keyFormat)
+        else:
+            self.JiraDf.to_excel(writer, sheet_name=self.sheetJira, index=False)   
+            self.format_keys(keys, keyFormat, writer.sheets[self.sheetJira])
+        return
+
+    @profile_stage('excel_diff', lambda self, writer:
+                   get_sheet_rows(writer.sheets[f"{self.jira} Story Changes{self.sheetSuffix}"]))
+    def excel_diff(self, writer):
+        """Write the stories that changed since last week or the baseline"""
+        changed = ((self.diffDf.Status != 'Present')
+                   | (self.diffDf['Points Change Since Last Week'] != 0)
+                   | (self.diffDf['Points Change Since BL'] != 0)
+                   | self.diffDf['Sprint Moved']
+                   | self.diffDf['Epic Moved'])
+        sheet = f"{self.jira} Story Changes{self.sheetSuffix}"
+        self.diffDf[changed].to_excel(writer, sheet_name=sheet, index_label='Key',
+                                      freeze_panes=(1, 1))
+        ws = writer.sheets[sheet]
+        ws.set_column(0, 0, 20)
+        ws.set_column(1, self.diffDf.shape[1], 14)
+        return
+
+    def excel_sprint_metrics(self, writer):
+        """Write the sprint metrics as of every sprint of the PI"""
+        sheet = f"{self.jira} Sprint Metrics{self.sheetSuffix}"
+        self.get_sprint_metrics_frame().to_excel(writer, sheet_name=sheet, freeze_panes=(1, 2))
+        ws = writer.sheets[sheet]
+        ws.set_column(0, 0, 14)
+        ws.set_column(1, 1, 50)
+        ws.set_column(2, len(self.sprintMetricCols + self.remainingMetricCols) + 1, 14)
         return
 
     @staticmethod
@@ -598,6 +854,7 @@ class Pivot:
             df.rename(index={df.index[0]:'Overall'}, inplace=True)
         return df
 
+    @profile_stage('set_stoplight_data', lambda self, *args: len(self.stoplightData))
     def set_stoplight_data(self, baseline, clin):
         baselinePer = self.get_clin(baseline.cumPer, clin)
         curPer = self.get_clin(self.cumPer, clin)
@@ -614,10 +871,9 @@ class Pivot:
         pointsData = pd.concat((pointsEpics, pointsTot))
 
         remEpics = self.get_clin(self.remainingSprintMetrics, clin)
-        remTot = (pd.DataFrame({'Overall': [np.nan] * remEpics.shape[1]})
-                .transpose().rename(columns={0: remEpics.columns[0],
-                                                1: remEpics.columns[1],
-                                                2: remEpics.columns[2]}))
+        # The CLIN has a forecast but no single velocity estimate
+        remTot = pd.DataFrame(np.nan, index=['Overall'], columns=remEpics.columns)
+        remTot[forecast.columns] = self.clinForecast.loc[[clin]].values
         remData = pd.concat((remEpics, remTot))
 
         pointsData = pd.concat((pointsData, remData), axis=1)
@@ -636,12 +892,31 @@ class Pivot:
         return
         
 
-    def create_stoplight_sheet(self, wb, clin):
-        letters = string.ascii_uppercase
+    @classmethod
+    def get_thresholds(cls, thresholds=None):
+        """(yellow, red) thresholds with None replaced by the defaults"""
+        if thresholds is None:
+            thresholds = cls.stoplightThresholds
+        return tuple(default if threshold is None else threshold
+                     for threshold, default in zip(thresholds, cls.stoplightThresholds))
+
+    @profile_stage('create_stoplight_sheet', lambda self, wb, clin, *args:
+                   get_sheet_rows(wb.get_worksheet_by_name(f'{clin} Stoplight{self.sheetSuffix}')))
+    def create_stoplight_sheet(self, wb, clin, thresholds=None):
+        """Write the stoplight graphic for a CLIN
+
+        thresholds is (yellow, red): an actual percentage more than yellow
+        below baseline is yellow, and red or further below is red. None
+        uses the default for that threshold.
+        """
+        thresholds = self.get_thresholds(thresholds)
         stoplightData = self.stoplightDict[clin]['Data'].copy()
         stoplightChange = self.stoplightDict[clin]['Change_BL'].copy()
-        PISprintCompleted = f"{stoplightData.columns[(self.lastCompleteSprint-1) * 2][:4]}.{self.lastCompleteSprint}"
+        # Labelled from the PI so sprint 0 does not pick up a points column
+        PISprintCompleted = f"{self.PI}.{self.lastCompleteSprint}"
         stoplightNumCols = stoplightData.shape[1]
+        # Baseline and actual columns for each sprint come before the points
+        numSprintCols = stoplightData.columns.get_loc('Current Total Pts')
 
         for idx in stoplightData.index:
             change = stoplightChange.loc[idx, 'Change Since BL']
@@ -650,32 +925,35 @@ class Pivot:
             elif change < 0:
                 stoplightData.loc[idx, 'Current Total Pts'] = f"{stoplightData.loc[idx, 'Current Total Pts']} ({int(change)})"
 
-        ws = wb.add_worksheet(f'{clin} Stoplight')
-
-        # Merge cells for headers
-        mergedHeaders = ['A1:A1', 'B1:C1', 'D1:E1', 'F1:G1',
-                        'H1:I1', 'J1:K1', 'L1:M1', 'N1:N1', 'O1:R1',
-                            f'S1:{letters[stoplightNumCols]}1']
-        for cellRange in mergedHeaders:
-            if cellRange[0] != cellRange[3]:
-                ws.merge_range(cellRange, '')
-
-        # Write and format headers
+        ws = wb.add_worksheet(f'{clin} Stoplight{self.sheetSuffix}')
+
+        # Header cells as (first col, last col, header), 0-indexed
+        numSprints = numSprintCols // 2
+        headers = [(0, 0, 'CLIN 2013')]
+        for sprint in range(1, numSprints+1):
+            header = f'Sprint {sprint}'
+            if sprint == numSprints:
+                header += ' (Planning Sprint)'
+            headers.append((sprint*2-1, sprint*2, header))
+        headers += [(numSprintCols+1, numSprintCols+1, 
+                     'Current Total Pts (Change Since PI Planning)'),
+                    (numSprintCols+2, numSprintCols+5, 
+                     f'Points Analysis (End Sprint {PISprintCompleted})'),
+                    (numSprintCols+6, numSprintCols+8, 
+                     f'Assumed Velocity Forcast (End Sprint {PISprintCompleted}'),
+                    (numSprintCols+9, stoplightNumCols, 
+                     f'Monte Carlo Forecast (End Sprint {PISprintCompleted})')]
+
+        # Merge cells for headers, then write and format headers
         headerFormat = wb.add_format(formats['header'])
-        
-        headers = ['CLIN 2013',
-                'Sprint 1', 'Sprint 2', 'Sprint 3', 
-                'Sprint 4', 'Sprint 5', 'Sprint 6 (Planning Sprint)',
-                'Current Total Pts (Change Since PI Planning)',
-                f'Points Analysis (End Sprint {PISprintCompleted})',
-                f'Assumed Velocity Forcast (End Sprint {PISprintCompleted}']
-
-        for idx, header in zip(mergedHeaders, headers):
-            ws.write(idx, header, headerFormat)
+        for firstCol, lastCol, header in headers:
+            if firstCol != lastCol:
+                ws.merge_range(0, firstCol, 0, lastCol, '')
+            ws.write(0, firstCol, header, headerFormat)
 
         # Write and format subheaders
         subheaderFormat = wb.add_format(formats['subheader'])
-        for col in range(1,13):
+        for col in range(1,numSprintCols+1):
             if col % 2 == 1:
                 subheader = 'Baseline'
             else:
@@ -685,22 +963,22 @@ class Pivot:
                     subheader = 'Projected'
             ws.write(1, col, subheader, subheaderFormat)
 
-        extraSubheaders = stoplightData.columns[12:] # Anything after sprint 1-6 data
-        for col in range(13,stoplightNumCols+1):
-            ws.write(1, col, extraSubheaders[col-13], subheaderFormat)
+        extraSubheaders = stoplightData.columns[numSprintCols:] # Anything after sprint data
+        for col in range(numSprintCols+1,stoplightNumCols+1):
+            ws.write(1, col, extraSubheaders[col-numSprintCols-1], subheaderFormat)
 
         # Column widths
         # ws.set_column(start_col, end_col, width) (columns are 0 indexed)
         ws.set_column(1, stoplightNumCols, 10) # default
         ws.set_column(0, 0, 30) # clin categories
-        ws.set_column(13, 13, 18) # current total
-        ws.set_column(14, stoplightNumCols, 12) # point metrics
+        ws.set_column(numSprintCols+1, numSprintCols+1, 18) # current total
+        ws.set_column(numSprintCols+2, stoplightNumCols, 12) # point metrics
 
         # Add epics
         epicFormat = wb.add_format(formats['epic'])
         numRows = stoplightData.index.shape[0]
         for i in range(numRows):
-            ws.write(f'A{i+3}', stoplightData.index[i], epicFormat)
+            ws.write(i+2, 0, stoplightData.index[i], epicFormat)
 
         # Add stoplight data
         dataFormatNumDelta = wb.add_format(formats['SLNumDelta'])
@@ -712,37 +990,36 @@ class Pivot:
         dataFormatRed = wb.add_format(formats['SLRed'])
         dataFormatBlue = wb.add_format(formats['SLBlue'])
 
+        # Format of every cell, computed for the whole table at once
+        values = stoplightData.values.astype(object)
+        numeric = stoplightData.apply(pd.to_numeric, errors='coerce').values.astype(float)
+        # If a nan, write empty cell
+        values[pd.isna(values) | np.isinf(numeric)] = ""
+
+        cellFormats = np.full(values.shape, dataFormatNum, dtype=object)
+        cellFormats[:, :numSprintCols] = dataFormatPer
+        cellFormats[:, stoplightData.columns.get_loc('Sprints Remaining')] = dataFormatDec
+        cellFormats[:, stoplightData.columns.get_loc('Chance Done by PI End')] = dataFormatPer
+        cellFormats[:, numSprintCols] = dataFormatNumDelta
+
+        # Sprints: actual vs baseline up to the current sprint
+        yellowThreshold, redThreshold = thresholds
+        diff = numeric[:, 1:numSprintCols:2] - numeric[:, 0:numSprintCols:2]
+        status = np.select([diff > yellowThreshold,     # On track/ahead
+                            diff > redThreshold,        # Slightly off track
+                            diff <= redThreshold],      # Off track
+                           [1, 2, 3], 0)
+        status[:, np.arange(status.shape[1]) >= self.curSprint] = 0
+        statusFormats = np.array([dataFormatPer, dataFormatGreen,
+                                  dataFormatYellow, dataFormatRed], dtype=object)
+        cellFormats[:, 1:numSprintCols:2] = statusFormats[status]
+
+        # Write each run of cells that share a format with one write_row
+        numCols = values.shape[1]
         for i in range(numRows):
-            for col in range(1,stoplightNumCols+1):
-                cellData = stoplightData.iloc[i, col-1]
-                # Sprints 1-6
-                if col in range(1,13):
-                    # Col is <= current sprint and is actual/projected
-                    if (col <= self.curSprint*2) & (col % 2 == 0):
-                        corrBLData = stoplightData.iloc[i, col-2]
-                        diff = cellData - corrBLData
-                        # On track/ahead
-                        if diff > -0.05:
-                            dataFormat = dataFormatGreen
-                        # Slightly off track
-                        if (diff <= -0.05) & (diff > -0.1):
-                            dataFormat = dataFormatYellow
-                        # Off track
-                        if (diff <= -0.1):
-                            dataFormat = dataFormatRed
-                    else:  
-                        dataFormat = dataFormatPer
-                # Points metrics
-                elif col == 13:
-                    dataFormat = dataFormatNumDelta
-                elif col == stoplightNumCols:
-                    dataFormat = dataFormatDec
-                else:
-                    dataFormat = dataFormatNum
-                # If a nan, write empty cell
-                try:
-                    ws.write(i+2, col, cellData, dataFormat)
-                except:
-                    ws.write(i+2, col, "", dataFormat)
-                
-        return
\ No newline at end of file
+            start = 0
+            for end in range(1, numCols+1):
+                if (end == numCols) or (cellFormats[i, end] is not cellFormats[i, start]):
+                    ws.write_row(i+2, start+1, values[i, start:end], cellFormats[i, start])
+                    start = end
+        return
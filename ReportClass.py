@@ -0,0 +1,333 @@
+import os
+import datetime as dt
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import regex as re
+import pandas as pd
+import xlsxwriter
+import profiler
+from PivotClass import Pivot
+from CalendarClass import PICalendar
+from errors import EmptyPIError, ThresholdError
+
+def load_pivots(jiraFiles, PILookupFile, epics, clins, PI,
+                cacheDir, calendar, jobs=1):
+    """Build the Current, Previous and Baseline pivots, in worker processes if jobs > 1"""
+    kwargs = {'cacheDir': cacheDir, 'calendar': calendar}
+    jiras = ["Current", "Previous", "Baseline"]
+    if jobs <= 1:
+        return [Pivot(jiraFile, PILookupFile, epics, clins, PI, jira=jira, **kwargs)
+                for jiraFile, jira in zip(jiraFiles, jiras)]
+
+    # Read the PI Lookup file here so workers receive it already parsed
+    calendar.PILookupDf
+    with ProcessPoolExecutor(max_workers=min(jobs, len(jiras))) as pool:
+        futures = [pool.submit(Pivot, jiraFile, PILookupFile, epics, clins, PI, jira=jira, **kwargs)
+                   for jiraFile, jira in zip(jiraFiles, jiras)]
+        return [future.result() for future in futures]
+
+def write_contributors(path, pivotDf):
+    pivotDf.to_excel(path, index=False)
+
+def write_pivot_workbook(path, PIPivots, exportPivots, streaming, allSprints=False):
+    """Pivot sheets of each PI's (cur, prev, baseline) pivots, then the Jira
+    exports once with the new and slipped stories of exportPivots highlighted"""
+    writer = pd.ExcelWriter(path, engine='xlsxwriter')
+    for cur, prev, baseline in PIPivots:
+        cur.excel_pivot(writer)
+        prev.excel_pivot(writer)
+        baseline.excel_pivot(writer)
+
+    cur, prev, baseline = exportPivots
+    cur.excel_Jira(writer, streaming=streaming)
+    prev.excel_Jira(writer, cur=cur, streaming=streaming)
+    baseline.excel_Jira(writer, cur=cur, streaming=streaming)
+    for cur, prev, baseline in PIPivots:
+        cur.excel_diff(writer)
+        if allSprints:
+            cur.excel_sprint_metrics(writer)
+    writer.book.close()
+
+def write_stoplight_workbook(path, curs, clins, thresholds):
+    wb = xlsxwriter.Workbook(path)
+    for cur in curs:
+        for clin in clins:
+            cur.create_stoplight_sheet(wb, clin, thresholds)
+    wb.close()
+
+def get_pivots(args):
+    """Pivots in args and the lists in args, each once, in order"""
+    pivots = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            pivots += [pivot for pivot in get_pivots(arg) if pivot not in pivots]
+        elif isinstance(arg, Pivot) and arg not in pivots:
+            pivots.append(arg)
+    return pivots
+
+def render(path, writeFunc, *args):
+    """Write one output file locally, then move it into place
+
+    Returns its profile record and the stage records each pivot in args
+    added while writing, so a worker process can send them back.
+    """
+    pivots = get_pivots(args)
+    numRecords = [len(pivot.profile) for pivot in pivots]
+    records = []
+    with profiler.stage(records, f"Write {os.path.basename(path)}"):
+        fd, tmpPath = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            writeFunc(tmpPath, *args)
+            # Copy next to the destination first so the final rename is atomic
+            partPath = f"{path}.part"
+            shutil.copyfile(tmpPath, partPath)
+            os.replace(partPath, path)
+        finally:
+            os.remove(tmpPath)
+    return records[0], [pivot.profile[num:] for pivot, num in zip(pivots, numRecords)]
+
+def render_outputs(outputs, jobs=1):
+    """Write each (path, writeFunc, *args) output, in worker processes if jobs > 1"""
+    if jobs <= 1:
+        results = [render(*output) for output in outputs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(outputs))) as pool:
+            futures = [pool.submit(render, *output) for output in outputs]
+            results = [future.result() for future in futures]
+            # Workers wrote from copies of the pivots, so add their stages here
+            for output, (record, pivotRecords) in zip(outputs, results):
+                for pivot, records in zip(get_pivots(output[2:]), pivotRecords):
+                    pivot.profile += records
+    records = [record for record, pivotRecords in results]
+    for output, record in zip(outputs, records):
+        print(f"Wrote {os.path.basename(output[0])} in {record['Wall (s)']:.2f}s")
+    return records
+
+class Report:
+    """Pivots, metrics and per-CLIN stoplight data for one current, previous
+    and baseline set of Jira exports, computed in memory
+
+    The exports and the PI Lookup file can be paths, bytes of an xlsx file or
+    DataFrames. Invalid inputs raise a StoplightError from errors.py. Nothing
+    is written until write() is called, so one process can build many reports
+    and reuse the PI calendar and parsed exports between them.
+
+    PIs is a list of PIs, or ['all'] for every PI in the current export, to
+    report on together. The exports are parsed and grouped by PI once, and
+    each PI gets its own pivots, metrics and sheets. Sprints of PIs before PI
+    are all complete and none of those after it are.
+    """
+    # Epics
+    # epics = ['ACE-1 CLIN 2013: Maps',
+    #          'ACE-1 CLIN 2013: Rapid Adaptive Planning (RAP)',
+    #         'ACE-1 CLIN 2013: RAPSAW SEIT',
+    #         'ACE-1 CLIN 2013: Resource Deconf. (RD) / Resource Viewer (RV)',
+    #         'ACE-1 CLIN 2016: CSS HW Engineering',
+    #         'ACE-1 CLIN 2016: ESS Solution',
+    #         'ACE-1 CLIN 2016: Multi-Factor Authentication (MFA) Solution',
+    #         'ACE-1 CLIN 2016: SEIT',
+    #         'ACE-1 CLIN 2016: SIEM and IDS',
+    #         'ACE-1 CLIN 2018: CAMD',
+    #         'ACE-1 CLIN 2018: CSS Extension',
+    #         'ACE-1 CLIN 2018: DevEnv Products',
+    #         'ACE-1 CLIN 2018: DevSecOps',
+    #         'ACE-1 CLIN 2018: EA SEIT',
+    #         'ACE-1 CLIN 2018: Enterprise Architecture HW Engineering'
+    #         ]
+    epics = [
+            'ACE-1 CLIN 2013: LAE BCB-1505',
+            'ACE-1 CLIN 2013: Rapid Adaptive Planning (RAP)',
+            'ACE-1 CLIN 2013: RAPSAW SEIT',
+            'ACE-1 CLIN 2013: Resource Deconf. (RD) / Resource Viewer (RV)',
+            'ACE-1 CLIN 2016: CSS HW Engineering',
+            'ACE-1 CLIN 2016: ESS Solution',
+            'ACE-1 CLIN 2016: Multi-Factor Authentication (MFA) Solution',
+            'ACE-1 CLIN 2016: SEIT',
+            'ACE-1 CLIN 2016: SIEM and IDS',
+            'ACE-1 CLIN 2018: CAMD',
+            'ACE-1 CLIN 2018: CSS Extension',
+            'ACE-1 CLIN 2018: DevEnv Products',
+            'ACE-1 CLIN 2018: DevSecOps',
+            'ACE-1 CLIN 2018: EA SEIT',
+            'ACE-1 CLIN 2018: Enterprise Architecture HW Engineering'
+            ]
+    clinPattern = re.compile(r"CLIN \d{4}")
+
+    def __init__(self, curSprint, lastCompleteSprint, PI,
+                 newJiraFile, prevJiraFile, baseJiraFile, PILookupFile,
+                 epics=None, cacheDir=None, calendar=None, compact=None,
+                 jobs=1, thresholds=None, PIs=None):
+        self.curSprint = curSprint
+        self.lastCompleteSprint = lastCompleteSprint
+        self.PI = PI
+        self.thresholds = Pivot.get_thresholds(thresholds)
+        yellowThreshold, redThreshold = self.thresholds
+        if yellowThreshold <= redThreshold:
+            raise ThresholdError(f"Yellow threshold {yellowThreshold} must be above the red " \
+                                 f"threshold {redThreshold}.")
+        if epics is not None:
+            self.epics = epics
+
+        # Clins
+        self.clins = sorted(list(set([re.search(self.clinPattern, epic).group()
+                                      for epic in self.epics])))
+
+        # PI dates shared by all pivots
+        if calendar is None:
+            calendar = PICalendar(PILookupFile)
+        self.calendar = calendar
+
+        # Phase timings, the pivots keep their own stage timings
+        self.records = []
+
+        # Instantiate pivots from current, previous, baseline weeks
+        with profiler.stage(self.records, 'Load pivots'):
+            self.exports = load_pivots(
+                [newJiraFile, prevJiraFile, baseJiraFile], PILookupFile,
+                self.epics, self.clins, PI, cacheDir, calendar, jobs)
+
+        # Shared categoricals for the three Jira frames
+        if compact:
+            with profiler.stage(self.records, 'Compact'):
+                categories = Pivot.get_categories(self.exports)
+                for pivot in self.exports:
+                    pivot.compact(categories)
+
+        # pivotDf is replaced by the slip rows in set_slip, so keep it now
+        self.contributors = {pivot.jira: pivot.pivotDf for pivot in self.exports}
+
+        # Pivots of each PI, the exports themselves for a single PI
+        if PIs is None:
+            self.PIs = [PI]
+            self.PIPivots = {PI: self.exports}
+        else:
+            allPIs = list(PIs) == ['all']
+            self.PIs = self.exports[0].get_PIs() if allPIs else list(PIs)
+            self.PIPivots = {}
+            with profiler.stage(self.records, 'Split PIs'):
+                for batchPI in self.PIs:
+                    self.PIPivots[batchPI] = [pivot.for_PI(batchPI, f" {batchPI}")
+                                              for pivot in self.exports]
+            if allPIs:
+                # Skip PIs with no stories in the pivoted epics
+                self.PIPivots = {batchPI: pivots for batchPI, pivots in self.PIPivots.items()
+                                 if any(not pivot.columnSchema.sprintColumns.empty
+                                        for pivot in pivots)}
+                self.PIs = list(self.PIPivots)
+        for batchPI, pivots in self.PIPivots.items():
+            self.set_metrics(batchPI, *pivots)
+
+        if not self.PIs:
+            raise EmptyPIError("No Jira export has stories in any PI. Please check the exports.")
+        # The report's own PI, or the first one reported
+        reportPI = PI if PI in self.PIPivots else self.PIs[0]
+        self.cur, self.prev, self.baseline = self.PIPivots[reportPI]
+        return
+
+    def get_sprints(self, PI, cur):
+        """Current and last complete sprint of a PI"""
+        if PI == self.PI:
+            return self.curSprint, self.lastCompleteSprint
+        if PI < self.PI:
+            lastSprint = max(cur.columnSchema.sprintPositions, default=0)
+            return lastSprint, lastSprint
+        return 0, 0
+
+    def set_metrics(self, PI, cur, prev, baseline):
+        """Diff, slip, metrics and stoplight data of one PI's pivots"""
+        # Snapshots without stories in the PI get the other snapshots' sprints
+        sprintColumns = sorted(set().union(*[pivot.columnSchema.sprintColumns
+                                             for pivot in (cur, prev, baseline)]))
+        if not sprintColumns:
+            raise EmptyPIError(f"No Jira export has stories in PI {PI}. Please check the PI.")
+        for pivot in (cur, prev, baseline):
+            pivot.fill_sprints(sprintColumns)
+
+        curSprint, lastCompleteSprint = self.get_sprints(PI, cur)
+        suffix = cur.sheetSuffix
+        with profiler.stage(self.records, f'Diff, slip and new{suffix}'):
+            # Align current, previous and baseline stories
+            prevDf, baselineDf = prev.get_PI_frame(), baseline.get_PI_frame()
+            cur.set_diff(prevDf, baselineDf)
+            prev.set_diff(prevDf, baselineDf)
+
+            # Set slips
+            cur.set_slip()
+            prev.set_slip()
+
+            # Set new stories
+            cur.set_new()
+
+        with profiler.stage(self.records, f'Metrics{suffix}'):
+            # Set changes since last week
+            cur.set_weekly_change(prev.pivotTable)
+
+            # Set cumulative metrics
+            cur.set_cum_metrics()
+            prev.set_cum_metrics()
+            baseline.set_cum_metrics()
+
+            # Set sprint metrics
+            cur.set_sprint_metrics(curSprint, lastCompleteSprint,
+                                    baseline.cumSum, baseline.cumPer)
+            prev.set_sprint_metrics(curSprint, lastCompleteSprint,
+                                    baseline.cumSum, baseline.cumPer)
+
+        # Separate by CLIN
+        with profiler.stage(self.records, f'Stoplight data{suffix}'):
+            cur.stoplightDict = {}
+            for clin in self.clins:
+                cur.set_stoplight_data(baseline, clin)
+                cur.stoplightDict[clin] = {'Data': cur.stoplightData,
+                                            'Change_BL': cur.changeBL}
+        return
+
+    @property
+    def pivots(self):
+        """Pivots by snapshot name: Current, Previous and Baseline"""
+        return {pivot.jira: pivot for pivot in [self.cur, self.prev, self.baseline]}
+
+    def get_pivots(self, PI):
+        """Pivots of a reported PI by snapshot name"""
+        return {pivot.jira: pivot for pivot in self.PIPivots[PI]}
+
+    @property
+    def stoplightDict(self):
+        """Stoplight Data and Change_BL frames by CLIN"""
+        return self.cur.stoplightDict
+
+    @property
+    def profile(self):
+        """Phase records, then the stage records of each pivot"""
+        pivots = list(self.exports)
+        for PIPivots in self.PIPivots.values():
+            pivots += [pivot for pivot in PIPivots if pivot not in pivots]
+        return self.records + [record for pivot in pivots for record in pivot.profile]
+
+    def write(self, stoplightDir, printContributors=None, streamExport=None, jobs=1,
+              allSprints=None):
+        """Write the pivot and stoplight workbooks to stoplightDir. Returns their paths"""
+        # Output files, written together in one stage
+        outputs = []
+        if printContributors is not None:
+            for jira, pivotDf in self.contributors.items():
+                outputs.append((os.path.join(stoplightDir, f"{jira}Contributors.xlsx"),
+                                write_contributors, pivotDf))
+
+        timestamp = dt.datetime.now().strftime("%y%m%d_%H%M%S")
+        excelFile = os.path.join(stoplightDir, f'Ground_Dev_ART_STOPLIGHT_{timestamp}.xlsx')
+        # The Jira exports highlight the new and slipped stories of self.cur's
+        # PI: the report's own PI, or the first PI reported if it is not one
+        outputs.append((excelFile, write_pivot_workbook,
+                        [self.PIPivots[PI] for PI in self.PIs],
+                        [self.cur, self.prev, self.baseline],
+                        bool(streamExport), bool(allSprints)))
+        stoplightFile = os.path.join(stoplightDir, f'Stoplight_Graphics_{timestamp}.xlsx')
+        outputs.append((stoplightFile, write_stoplight_workbook,
+                        [self.PIPivots[PI][0] for PI in self.PIs], self.clins, self.thresholds))
+        with profiler.stage(self.records, 'Render outputs'):
+            fileRecords = render_outputs(outputs, jobs)
+        self.records += fileRecords
+        return [output[0] for output in outputs]
@@ -0,0 +1,40 @@
+import pandas as pd
+import numpy as np
+
+class ColumnSchema:
+    """Pivot columns parsed once into PI, sprint number, position and kind
+
+    Kind is 'Sprint' for columns like '23.2-S3', 'Backlog', 'Slip' or
+    'Grand Total' for those columns, and 'Other' for anything else. Finding
+    the column of a sprint is then a dict lookup instead of a regex over
+    every column.
+    """
+    kinds = ['Backlog', 'Slip', 'Grand Total']
+
+    def __init__(self, columns):
+        self.columns = pd.Index(columns)
+        names = pd.Series(self.columns.astype(str))
+        parts = names.str.extract(r'(\d{2}\.\d)-S(\d)')
+        self.PI = parts[0].values
+        self.sprint = pd.to_numeric(parts[1]).values
+        self.position = np.arange(len(self.columns))
+        self.kind = np.where(parts[1].notna(), 'Sprint',
+                             names.where(names.isin(self.kinds), 'Other'))
+
+        # Position of the first column of each sprint number
+        sprintPos = self.position[self.kind == 'Sprint']
+        self.sprintPositions = {int(self.sprint[pos]): pos for pos in sprintPos[::-1]}
+        return
+
+    @property
+    def sprintColumns(self):
+        """Sprint columns in pivot order"""
+        return self.columns[self.kind == 'Sprint']
+
+    def get_sprint(self, sprint):
+        """Column of a sprint number, e.g. 3 gives '23.2-S3'"""
+        return self.columns[self.sprintPositions[int(sprint)]]
+
+    def to_frame(self):
+        return pd.DataFrame({'Column': self.columns, 'PI': self.PI, 'Sprint': self.sprint,
+                             'Position': self.position, 'Kind': self.kind})
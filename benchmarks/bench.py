@@ -0,0 +1,143 @@
+# Times each Pivot stage and Main.main end to end on generated exports
+#
+# e.g.: "python benchmarks/bench.py --rows 1000 10000 100000 --repeat 3"
+# Fixtures are generated once per size and seed under workDir and reused by
+# later runs. Everything runs offline: the PI Lookup and Sprints files are
+# generated with the exports and the cache is off unless --cacheDir is given.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import Main
+import profiler
+from CalendarClass import PICalendar
+import generate
+import golden
+
+def get_fixtures(workDir, rows, PI, seed):
+    """Paths of the generated files for rows, generating them if missing"""
+    fixtureDir = os.path.join(workDir, f"fixtures_{rows}_{PI}_{seed}")
+    paths = {name: os.path.join(fixtureDir, f"{name}.xlsx")
+             for name in ['Current', 'Previous', 'Baseline', 'PI_Lookup', 'Sprints']}
+    if not all(os.path.exists(path) for path in paths.values()):
+        print(f"Generating {rows} row exports in {fixtureDir}")
+        paths = generate.write_fixtures(fixtureDir, rows, PI, seed)
+    return paths
+
+def run_main(paths, outputDir, curSprint, lastCompleteSprint, PI, **kwargs):
+    """Run Main.main, returns its profile records"""
+    shutil.rmtree(outputDir, ignore_errors=True)
+    os.makedirs(outputDir)
+    calendar = PICalendar(paths['PI_Lookup'], paths['Sprints'])
+    records = []
+    with profiler.stage(records, 'Main.main end to end'):
+        report = Main.main(curSprint, lastCompleteSprint, PI,
+                           paths['Current'], paths['Previous'], paths['Baseline'],
+                           outputDir, paths['PI_Lookup'], None,
+                           calendar=calendar, **kwargs)
+    return records + report.profile
+
+def summarize(runs, rows):
+    """Median of each stage over the runs. Stages run more than once per run are summed"""
+    df = pd.concat([pd.DataFrame(records).assign(Run=run) for run, records in enumerate(runs)])
+    df['Snapshot'] = df.Snapshot.fillna('')
+    # Output files are timestamped, so runs are matched on the name without it
+    df['Stage'] = df.Stage.str.replace(r'_\d{6}_\d{6}', '', regex=True)
+    df['Order'] = range(len(df))
+    summed = (df.groupby(['Run', 'Stage', 'Snapshot'], sort=False)
+                .agg({'Wall (s)': 'sum', 'CPU (s)': 'sum', 'Peak RSS (MB)': 'max',
+                      'Rows': 'max', 'Order': 'min'}))
+    median = (summed.groupby(['Stage', 'Snapshot'], sort=False)
+                    .agg({'Wall (s)': 'median', 'CPU (s)': 'median', 'Peak RSS (MB)': 'max',
+                          'Rows': 'max', 'Order': 'min'})
+                    .sort_values('Order')
+                    .drop(columns='Order')
+                    .reset_index())
+    median.insert(0, 'Export Rows', rows)
+    median = median.round({'Wall (s)': 4, 'CPU (s)': 4}).astype({'Rows': 'Int64'})
+    return median.astype(object).where(median.notna(), None).to_dict('records')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times each Pivot stage and Main.main "
+                                     + "end to end on synthetic Jira exports.")
+    parser.add_argument('--rows',
+                        help='INT: Approximate rows per export, one benchmark per size',
+                        type=int,
+                        nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--repeat',
+                        help='INT: Runs per size, the median of each stage is reported',
+                        type=int,
+                        default=1)
+    parser.add_argument('--workDir',
+                        help='Directory for the generated exports and the results',
+                        default=os.path.join(tempfile.gettempdir(), 'stoplight_bench'))
+    parser.add_argument('--PI',
+                        help='str: PI the exports are reported in',
+                        default='23.2')
+    parser.add_argument('--sprint',
+                        help='INT: Current sprint',
+                        type=int,
+                        default=4)
+    parser.add_argument('--lastCompleteSprint',
+                        help='INT: Last complete sprint',
+                        type=int,
+                        default=3)
+    parser.add_argument('--seed',
+                        help='INT: Random seed for the generated exports',
+                        type=int,
+                        default=0)
+    parser.add_argument('--cacheDir',
+                        help='Directory for the parsed export cache. Default is no cache')
+    parser.add_argument('--compact',
+                        help='Flag to run Main.main with --compact',
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--jobs',
+                        help='INT: Number of processes passed to Main.main',
+                        type=int,
+                        default=1)
+    parser.add_argument('--streamExport',
+                        help='Flag to run Main.main with --streamExport',
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--golden',
+                        help='Flag to also check each size against the legacy version with golden.py',
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--legacy',
+                        help='Git ref or directory of the legacy version for --golden. '
+                             'Default is the first commit')
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    for rows in args.rows:
+        paths = get_fixtures(args.workDir, rows, args.PI, args.seed)
+        runs = []
+        for run in range(args.repeat):
+            outputDir = os.path.join(args.workDir, f"output_{rows}")
+            runs.append(run_main(paths, outputDir, args.sprint, args.lastCompleteSprint,
+                                 args.PI, cacheDir=args.cacheDir, compact=args.compact,
+                                 jobs=args.jobs, streamExport=args.streamExport))
+        summary = summarize(runs, rows)
+        print(f"{rows} rows: {summary[0]['Wall (s)']}s end to end")
+        results += summary
+
+        if args.golden:
+            diffs, notes = golden.check([paths['Current'], paths['Previous'], paths['Baseline']],
+                                        paths['PI_Lookup'], args.sprint,
+                                        args.lastCompleteSprint, args.PI, args.legacy,
+                                        candidateKwargs={'compact': args.compact,
+                                                         'jobs': args.jobs,
+                                                         'streamExport': args.streamExport})
+            golden.print_report(diffs, notes)
+            failed = failed or bool(diffs)
+
+    profiler.write_report(results, args.workDir, 'bench', ['Export Rows'] + profiler.columns)
+    print(open(os.path.join(args.workDir, 'bench.txt')).read())
+    if failed:
+        print("Golden output check failed. Now exiting...")
+        sys.exit(1)
@@ -0,0 +1,285 @@
+# Synthetic Jira exports, PI Lookup and Sprints files for benchmarking
+#
+# e.g.: "python benchmarks/generate.py outputDir --rows 100000 --PI 23.2"
+# writes Current.xlsx, Previous.xlsx, Baseline.xlsx, PI_Lookup.xlsx and
+# Sprints.xlsx. The baseline is generated first, the previous export is the
+# baseline one snapshot later and the current export is the previous one
+# snapshot later, each with a controlled share of slipped, added, re-pointed
+# and removed stories.
+
+import argparse
+import datetime as dt
+import os
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+# Same epics as Report in ReportClass.py, plus one that no pivot should pick up
+epics = [
+    'ACE-1 CLIN 2013: LAE BCB-1505',
+    'ACE-1 CLIN 2013: Rapid Adaptive Planning (RAP)',
+    'ACE-1 CLIN 2013: RAPSAW SEIT',
+    'ACE-1 CLIN 2013: Resource Deconf. (RD) / Resource Viewer (RV)',
+    'ACE-1 CLIN 2016: CSS HW Engineering',
+    'ACE-1 CLIN 2016: ESS Solution',
+    'ACE-1 CLIN 2016: Multi-Factor Authentication (MFA) Solution',
+    'ACE-1 CLIN 2016: SEIT',
+    'ACE-1 CLIN 2016: SIEM and IDS',
+    'ACE-1 CLIN 2018: CAMD',
+    'ACE-1 CLIN 2018: CSS Extension',
+    'ACE-1 CLIN 2018: DevEnv Products',
+    'ACE-1 CLIN 2018: DevSecOps',
+    'ACE-1 CLIN 2018: EA SEIT',
+    'ACE-1 CLIN 2018: Enterprise Architecture HW Engineering',
+    'ACE-1 Sustainment: Other Work'
+    ]
+teams = ['Alpha', 'Bravo', 'Charlie', 'Delta', 'Echo', 'Foxtrot']
+
+# Jira export columns A:P, Key in column B as in the real export
+columns = ['Issue Type', 'Key', 'Summary', 'Index', 'Sprint', 'Σ Story Points',
+           'Planned Start Date', 'Planned End Date', 'Status', 'Assignee',
+           'Reporter', 'Priority', 'Labels', 'Fix Version/s', 'Created', 'Updated']
+
+sprintsPerPI = 6
+sprintDays = 14
+
+def get_PIs(PI, numBefore=2, numAfter=2):
+    """PI names around PI, e.g. '23.2' gives ['22.4', '23.1', '23.2', '23.3', '23.4']"""
+    year, quarter = [int(part) for part in PI.split('.')]
+    PIs = []
+    for offset in range(-numBefore, numAfter + 1):
+        pos = year * 4 + quarter - 1 + offset
+        PIs.append(f"{pos // 4}.{pos % 4 + 1}")
+    return PIs
+
+def get_calendar(PI, start=dt.datetime(2023, 1, 3)):
+    """PI Lookup and Sprints frames for the PIs around PI, back to back from start"""
+    PIRows = []
+    sprintRows = []
+    PIStart = pd.Timestamp(start)
+    for name in get_PIs(PI):
+        PIEnd = PIStart + pd.Timedelta(days=sprintsPerPI * sprintDays - 1)
+        PIRows.append([f"PI {name}", PIStart, PIEnd])
+        for sprint in range(1, sprintsPerPI + 1):
+            sprintStart = PIStart + pd.Timedelta(days=(sprint - 1) * sprintDays)
+            sprintName = 'IP' if sprint == sprintsPerPI else sprint
+            sprintRows.append([f"{name}.{sprintName}", sprintStart,
+                               sprintStart + pd.Timedelta(days=sprintDays - 1)])
+        PIStart = PIEnd + pd.Timedelta(days=1)
+    PILookupDf = pd.DataFrame(PIRows, columns=['PI', 'Start', 'End'])
+    sprintsDf = pd.DataFrame(sprintRows, columns=['Sprint', 'Start', 'End'])
+    return PILookupDf, sprintsDf
+
+def get_sprint_text(PIs, sprints, teams):
+    """Jira Sprint strings, e.g. 'PI 23.2 - S3 PCM_GD_Alpha'"""
+    return ('PI ' + pd.Series(PIs, dtype=object) + ' - S' + pd.Series(sprints).astype(str)
+            + ' PCM_GD_' + pd.Series(teams, dtype=object)).values
+
+def generate_export(rows, PI, seed=0, capabilities=3, stories=8):
+    """Jira export with about rows rows: epics, capabilities, features and stories
+
+    Rows are in hierarchy order with a dotted Index ('1', '1.2', '1.2.3',
+    '1.2.3.4'). Features carry the planned dates; stories carry the Sprint
+    and story points.
+    """
+    rng = np.random.default_rng(seed)
+    numEpics = len(epics)
+    features = max(1, round(((rows / numEpics - 1) / capabilities - 1) / (1 + stories)))
+    PIs = get_PIs(PI)
+    PILookupDf, _ = get_calendar(PI)
+
+    # Hierarchy position of every row, 0 where a level does not apply
+    epicPos = np.arange(1, numEpics + 1)
+    capEpic = np.repeat(epicPos, capabilities)
+    capPos = np.tile(np.arange(1, capabilities + 1), numEpics)
+    featEpic = np.repeat(capEpic, features)
+    featCap = np.repeat(capPos, features)
+    featPos = np.tile(np.arange(1, features + 1), len(capPos))
+    storyEpic = np.repeat(featEpic, stories)
+    storyCap = np.repeat(featCap, stories)
+    storyFeat = np.repeat(featPos, stories)
+    storyPos = np.tile(np.arange(1, stories + 1), len(featPos))
+    levels = np.concatenate([
+        np.column_stack([epicPos, 0 * epicPos, 0 * epicPos, 0 * epicPos]),
+        np.column_stack([capEpic, capPos, 0 * capPos, 0 * capPos]),
+        np.column_stack([featEpic, featCap, featPos, 0 * featPos]),
+        np.column_stack([storyEpic, storyCap, storyFeat, storyPos])])
+    issueType = np.concatenate([np.full(len(epicPos), 'Portfolio Epic', dtype=object),
+                                np.full(len(capPos), 'Capability', dtype=object),
+                                np.full(len(featPos), 'Feature', dtype=object),
+                                rng.choice(np.array(['Story', 'Enabler'], dtype=object),
+                                           len(storyPos), p=[0.8, 0.2])])
+    order = np.lexsort(levels.T[::-1])
+    levels = levels[order]
+    issueType = issueType[order]
+    n = len(levels)
+
+    # Dotted Index, parents are always before their children
+    parts = pd.DataFrame(levels).astype(str).replace('0', np.nan)
+    index = parts[0]
+    for level in range(1, 4):
+        index = (index + '.' + parts[level]).fillna(index)
+
+    df = pd.DataFrame({'Issue Type': issueType, 'Index': index.values})
+    epic = (issueType == 'Portfolio Epic')
+    capability = (issueType == 'Capability')
+    feature = (issueType == 'Feature')
+    story = ~(epic | capability | feature)
+    # Team stories have team project keys, e.g. 'PCM_GD_ALPHA-12'
+    team = rng.choice(np.array(teams, dtype=object), n)
+    keyNum = np.arange(1, n + 1).astype(str).astype(object)
+    teamKey = 'PCM_GD_' + pd.Series(team).str.upper().values + '-' + keyNum
+    df['Key'] = np.where(epic, 'SPACE-' + keyNum,
+                         np.where(story, teamKey, 'ACE-' + keyNum))
+    df['Summary'] = np.where(epic, np.array(epics, dtype=object)[levels[:, 0] - 1],
+                             df['Issue Type'] + ' ' + df['Index'])
+
+    # Features mostly planned in the reporting PI and the one before it
+    featurePI = rng.choice(len(PIs), n, p=[0.1, 0.3, 0.45, 0.1, 0.05])
+    featureStart = (PILookupDf.Start.values[featurePI]
+                    + rng.integers(0, 40, n).astype('timedelta64[D]'))
+    df['Planned Start Date'] = pd.Series(featureStart).where(feature)
+    df['Planned End Date'] = (df['Planned Start Date']
+                              + pd.Timedelta(days=sprintsPerPI * sprintDays - 1))
+
+    # Stories in their feature's PI, some in the backlog, unplanned or
+    # already slipped from an earlier sprint
+    featurePI = pd.Series(np.where(feature, featurePI, np.nan)).ffill().fillna(0).astype(int).values
+    sprint = rng.integers(1, sprintsPerPI + 1, n)
+    PIName = np.array(PIs, dtype=object)[featurePI]
+    text = get_sprint_text(PIName, sprint, team)
+    prevPIName = np.array(PIs, dtype=object)[np.clip(featurePI - 1, 0, None)]
+    slipped = get_sprint_text(prevPIName, np.full(n, sprintsPerPI), team) + ', ' + text
+    kind = rng.random(n)
+    text = np.where(kind < 0.08, 'Backlog PCM_GD_' + team,
+                    np.where(kind < 0.15, np.nan,
+                             np.where(kind < 0.3, slipped, text)))
+    df['Sprint'] = np.where(story, text, np.nan)
+    points = rng.choice([1, 2, 3, 5, 8, 13, np.nan], n,
+                        p=[0.15, 0.2, 0.25, 0.2, 0.1, 0.03, 0.07])
+    df['Σ Story Points'] = np.where(story, points, np.nan)
+
+    # Columns the Stoplight does not use, filled so the file has a realistic size
+    df['Status'] = rng.choice(np.array(['To Do', 'In Progress', 'Done'], dtype=object), n)
+    df['Assignee'] = 'User ' + pd.Series(rng.integers(1, 200, n)).astype(str)
+    df['Reporter'] = 'User ' + pd.Series(rng.integers(1, 50, n)).astype(str)
+    df['Priority'] = rng.choice(np.array(['Low', 'Medium', 'High'], dtype=object), n)
+    df['Labels'] = np.where(story, 'PCM_GD', np.nan)
+    df['Fix Version/s'] = 'Release ' + pd.Series(PIName).str.replace('.', '_', regex=False)
+    df['Created'] = PILookupDf.Start.iloc[0] + pd.to_timedelta(rng.integers(0, 60, n), unit='D')
+    df['Updated'] = df['Created'] + pd.to_timedelta(rng.integers(0, 200, n), unit='D')
+    return df[columns]
+
+def get_next_sprint(sprint):
+    """Sprint string with the next sprint appended, as Jira records a slip"""
+    last = sprint.split(', ')[-1]
+    PIName, rest = last[3:].split(' - S')
+    num, team = rest.split(' ', 1)
+    if int(num) < sprintsPerPI:
+        nextPI, nextNum = PIName, int(num) + 1
+    else:
+        nextPI, nextNum = get_PIs(PIName, 0, 1)[-1], 1
+    return f"{sprint}, PI {nextPI} - S{nextNum} {team}"
+
+def evolve(df, seed, slipRate=0.05, addRate=0.03, pointsRate=0.02, dropRate=0.01):
+    """The same export one snapshot later
+
+    slipRate of the sprint-assigned stories move to their next sprint,
+    pointsRate get new story points, dropRate are removed and new stories of
+    addRate times the story count are added under random features.
+    """
+    rng = np.random.default_rng(seed)
+    df = df.copy()
+    story = df['Issue Type'].isin(['Story', 'Enabler']).values
+    inSprint = story & df.Sprint.str.startswith('PI ').fillna(False).values
+
+    slip = inSprint & (rng.random(len(df)) < slipRate)
+    df.loc[slip, 'Sprint'] = df.loc[slip, 'Sprint'].map(get_next_sprint)
+    repoint = story & (rng.random(len(df)) < pointsRate)
+    df.loc[repoint, 'Σ Story Points'] = rng.choice([1, 2, 3, 5, 8], repoint.sum())
+    df = df[~(story & (rng.random(len(df)) < dropRate))].reset_index(drop=True)
+
+    # New stories go after the last existing child of their feature
+    numAdded = int(story.sum() * addRate)
+    story = df['Issue Type'].isin(['Story', 'Enabler'])
+    features = np.flatnonzero(df['Issue Type'].values == 'Feature')
+    if numAdded == 0 or len(features) == 0:
+        return df
+    split = df.Index.str.rsplit('.', n=1)
+    parent = split.str[0].where(story)
+    childMax = split.str[-1].astype(int).groupby(parent.values).max()
+    lastPos = pd.Series(np.arange(len(df)), index=df.Index).copy()
+    lastChild = pd.Series(np.arange(len(df))).groupby(parent.values).max()
+    lastPos.loc[lastChild.index] = lastChild.values
+
+    parentPos = np.sort(rng.choice(features, numAdded))
+    parentIndex = df.Index.values[parentPos]
+    newNum = (childMax.reindex(parentIndex).fillna(0).values
+              + pd.Series(parentIndex).groupby(parentIndex).cumcount().values + 1)
+    # Start new stories from random existing stories so they look alike
+    added = df[story].sample(numAdded, replace=True, random_state=seed).reset_index(drop=True)
+    maxKey = df.Key.str.extract(r'-(\d+)$', expand=False).astype(int).max()
+    added['Index'] = [f"{index}.{int(num)}" for index, num in zip(parentIndex, newNum)]
+    added['Key'] = (added.Key.str.rsplit('-', n=1).str[0] + '-'
+                    + pd.Series(range(maxKey + 1, maxKey + numAdded + 1)).astype(str))
+    added['Summary'] = added['Issue Type'] + ' ' + added['Index']
+    added['Planned Start Date'] = pd.NaT
+    added['Planned End Date'] = pd.NaT
+
+    sortKey = np.concatenate([np.arange(len(df)),
+                              lastPos.loc[parentIndex].values + 0.5])
+    df = pd.concat([df, added], ignore_index=True)
+    df = df.iloc[np.argsort(sortKey, kind='stable')].reset_index(drop=True)
+    return df
+
+def write_export(df, path):
+    """Write an export row by row in constant memory, dates as excel dates"""
+    wb = xlsxwriter.Workbook(path, {'constant_memory': True,
+                                    'default_date_format': 'yyyy-mm-dd',
+                                    'nan_inf_to_errors': True})
+    ws = wb.add_worksheet()
+    ws.write_row(0, 0, list(df.columns))
+    values = df.astype(object).where(df.notna(), None)
+    for row, values in enumerate(values.itertuples(index=False), start=1):
+        ws.write_row(row, 0, [value.to_pydatetime() if isinstance(value, pd.Timestamp)
+                              else value for value in values])
+    wb.close()
+    return
+
+def write_fixtures(outputDir, rows, PI='23.2', seed=0):
+    """Write the three exports and the calendar files, returns their paths"""
+    os.makedirs(outputDir, exist_ok=True)
+    paths = {name: os.path.join(outputDir, f"{name}.xlsx")
+             for name in ['Current', 'Previous', 'Baseline', 'PI_Lookup', 'Sprints']}
+    baselineDf = generate_export(rows, PI, seed)
+    prevDf = evolve(baselineDf, seed + 1)
+    curDf = evolve(prevDf, seed + 2)
+    for name, df in [('Baseline', baselineDf), ('Previous', prevDf), ('Current', curDf)]:
+        write_export(df, paths[name])
+
+    PILookupDf, sprintsDf = get_calendar(PI)
+    PILookupDf.to_excel(paths['PI_Lookup'], sheet_name='PI Lookup', index=False)
+    sprintsDf.to_excel(paths['Sprints'], index=False)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes synthetic current, previous "
+                                     + "and baseline Jira exports with PI Lookup and "
+                                     + "Sprints files for benchmarking.")
+    parser.add_argument('outputDir',
+                        help='Directory where the files are written')
+    parser.add_argument('--rows',
+                        help='INT: Approximate number of rows in each export',
+                        type=int,
+                        default=1000)
+    parser.add_argument('--PI',
+                        help='str: PI the exports are reported in',
+                        default='23.2')
+    parser.add_argument('--seed',
+                        help='INT: Random seed',
+                        type=int,
+                        default=0)
+    args = parser.parse_args()
+    paths = write_fixtures(args.outputDir, args.rows, args.PI, args.seed)
+    for name, path in paths.items():
+        print(f"Wrote {name} to {path}")
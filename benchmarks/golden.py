@@ -0,0 +1,285 @@
+# Golden output check: runs a legacy and a candidate version of the Stoplight
+# on the same exports and diffs every intermediate frame and workbook cell
+#
+# e.g.: "python benchmarks/golden.py Current.xlsx Previous.xlsx Baseline.xlsx
+#        PI_Lookup.xlsx --legacy ec591b3"
+# The legacy and candidate versions can each be a git ref or a directory. The
+# default legacy version is the first commit of the repo and the default
+# candidate is the working tree. Each version runs Main.main in its own
+# process, so both can use the same module names.
+
+import argparse
+import glob
+import io
+import json
+import os
+import pickle
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import numpy as np
+import pandas as pd
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Pivot attributes compared by default. stoplightDict is each CLIN's
+# stoplight Data and Change_BL
+frames = ['pivotTable', 'slipPivotTable', 'changesWeek', 'cumSum', 'cumPer',
+          'clinDf', 'sprintMetrics', 'remainingSprintMetrics', 'stoplightDict']
+
+def get_source(version, workDir, name):
+    """Directory holding version, extracting it from git if it is a ref"""
+    if version is None:
+        return repoDir
+    if os.path.isdir(version):
+        return version
+    archive = subprocess.run(['git', '-C', repoDir, 'archive', '--format=tar', version],
+                             capture_output=True, check=True).stdout
+    sourceDir = os.path.join(workDir, name)
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(sourceDir)
+    return sourceDir
+
+def get_first_commit():
+    commits = subprocess.run(['git', '-C', repoDir, 'rev-list', '--max-parents=0', 'HEAD'],
+                             capture_output=True, text=True, check=True).stdout.split()
+    return commits[-1]
+
+def run_version(sourceDir, outputDir, mainArgs, mainKwargs):
+    """Run Main.main from sourceDir and pickle the pivots' frames to outputDir
+
+    Called in a fresh process. The Pivots are captured when set_cum_metrics
+    runs, which every version calls on all three snapshots.
+    """
+    sys.path.insert(0, sourceDir)
+    import Main
+    from PivotClass import Pivot
+    pivots = {}
+    setCumMetrics = Pivot.set_cum_metrics
+    def capture(self, *args, **kwargs):
+        pivots[self.jira] = self
+        return setCumMetrics(self, *args, **kwargs)
+    Pivot.set_cum_metrics = capture
+
+    # mainArgs are the sprints, PI, exports and PI Lookup file
+    Main.main(*mainArgs[:6], outputDir, mainArgs[6], None, **mainKwargs)
+
+    results = {}
+    for jira, pivot in pivots.items():
+        for name, value in vars(pivot).items():
+            if isinstance(value, (pd.DataFrame, pd.Series)):
+                results[f"{jira} {name}"] = value
+        for clin, data in getattr(pivot, 'stoplightDict', {}).items():
+            for name, value in data.items():
+                results[f"{jira} stoplightDict {clin} {name}"] = value
+    with open(os.path.join(outputDir, 'frames.pkl'), 'wb') as f:
+        pickle.dump(results, f)
+    return
+
+def normalize(frame):
+    """Frame with categoricals as objects, so storage differences are not diffs"""
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    frame = frame.copy()
+    for col in frame.columns[frame.dtypes.map(lambda dtype: isinstance(dtype, pd.CategoricalDtype))]:
+        frame[col] = frame[col].astype(object)
+    if isinstance(frame.index, pd.CategoricalIndex):
+        frame.index = frame.index.astype(object)
+    if isinstance(frame.columns, pd.CategoricalIndex):
+        frame.columns = frame.columns.astype(object)
+    return frame
+
+def compare_frames(legacy, candidate, names, rtol=1e-9, atol=1e-9):
+    """Differences between the legacy and candidate frames whose attribute is in names
+
+    Returns (diffs, notes). Columns only in the candidate are notes, not diffs.
+    """
+    diffs = []
+    notes = []
+    for key, legacyFrame in legacy.items():
+        if key.split(' ')[1] not in names:
+            continue
+        if key not in candidate:
+            diffs.append(f"{key}: missing from candidate")
+            continue
+        legacyFrame = normalize(legacyFrame)
+        candidateFrame = normalize(candidate[key])
+        newCols = candidateFrame.columns.difference(legacyFrame.columns, sort=False)
+        if len(newCols) and legacyFrame.columns.isin(candidateFrame.columns).all():
+            notes.append(f"{key}: columns only in candidate {list(newCols)}")
+            candidateFrame = candidateFrame[legacyFrame.columns]
+        try:
+            pd.testing.assert_frame_equal(legacyFrame, candidateFrame,
+                                          check_dtype=False, check_exact=False,
+                                          check_index_type=False, check_column_type=False,
+                                          rtol=rtol, atol=atol)
+        except AssertionError as error:
+            diffs.append(f"{key}: {error}")
+    return diffs, notes
+
+def is_equal(a, b, rtol, atol):
+    """Cell values are equal, numbers within tolerance and blanks equal to blanks"""
+    if pd.isna(a) and pd.isna(b):
+        return True
+    if isinstance(a, (int, float, np.number)) and isinstance(b, (int, float, np.number)):
+        return bool(np.isclose(a, b, rtol=rtol, atol=atol))
+    return a == b
+
+def compare_workbooks(legacyDir, candidateDir, rtol=1e-9, atol=1e-9, maxDiffs=10):
+    """Differences between the cell values of the workbooks in two output directories
+
+    Returns (diffs, notes). Sheets, and columns after the legacy ones, only in
+    the candidate are notes, not diffs.
+    """
+    def get_files(outputDir):
+        files = glob.glob(os.path.join(outputDir, 'Stoplight_*', '*.xlsx'))
+        # Output file names end in a timestamp, e.g. _231018_142838
+        return {re.sub(r'_\d{6}_\d{6}', '', os.path.splitext(os.path.basename(path))[0]): path
+                for path in files}
+    legacyFiles = get_files(legacyDir)
+    candidateFiles = get_files(candidateDir)
+    diffs = []
+    notes = []
+    for name, legacyFile in legacyFiles.items():
+        if name not in candidateFiles:
+            diffs.append(f"{name}: missing from candidate")
+            continue
+        legacySheets = pd.read_excel(legacyFile, sheet_name=None, header=None)
+        candidateSheets = pd.read_excel(candidateFiles[name], sheet_name=None, header=None)
+        for sheet in candidateSheets.keys() - legacySheets.keys():
+            notes.append(f"{name} '{sheet}': only in candidate")
+        for sheet, legacyDf in legacySheets.items():
+            if sheet not in candidateSheets:
+                diffs.append(f"{name} '{sheet}': missing from candidate")
+                continue
+            candidateDf = candidateSheets[sheet]
+            if (legacyDf.shape[0] == candidateDf.shape[0]
+                    and legacyDf.shape[1] < candidateDf.shape[1]):
+                notes.append(f"{name} '{sheet}': {candidateDf.shape[1] - legacyDf.shape[1]} "
+                             "columns only in candidate")
+                candidateDf = candidateDf.iloc[:, :legacyDf.shape[1]]
+            if legacyDf.shape != candidateDf.shape:
+                diffs.append(f"{name} '{sheet}': shape {legacyDf.shape} != {candidateDf.shape}")
+                continue
+            cells = [(row, col) for row in range(legacyDf.shape[0])
+                     for col in range(legacyDf.shape[1])
+                     if not is_equal(legacyDf.iat[row, col], candidateDf.iat[row, col],
+                                     rtol, atol)]
+            for row, col in cells[:maxDiffs]:
+                diffs.append(f"{name} '{sheet}' row {row + 1} col {col + 1}: "
+                             f"{legacyDf.iat[row, col]!r} != {candidateDf.iat[row, col]!r}")
+            if len(cells) > maxDiffs:
+                diffs.append(f"{name} '{sheet}': {len(cells) - maxDiffs} more cells differ")
+    return diffs, notes
+
+def check(jiraFiles, PILookupFile, curSprint, lastCompleteSprint, PI,
+          legacy=None, candidate=None, candidateKwargs=None, names=frames,
+          rtol=1e-9, atol=1e-9, workDir=None):
+    """Run both versions on the same inputs. Returns (diffs, notes)
+
+    Without a workDir the sources and outputs go to a temp directory that is
+    removed afterwards.
+    """
+    if workDir is None:
+        workDir = tempfile.mkdtemp(prefix='stoplight_golden_')
+        try:
+            return check(jiraFiles, PILookupFile, curSprint, lastCompleteSprint, PI,
+                         legacy, candidate, candidateKwargs, names, rtol, atol, workDir)
+        finally:
+            shutil.rmtree(workDir, ignore_errors=True)
+    legacy = get_first_commit() if legacy is None else legacy
+    mainArgs = [curSprint, lastCompleteSprint, PI, *jiraFiles, PILookupFile]
+    outputDirs = {}
+    for name, version, kwargs in [('legacy', legacy, {}),
+                                  ('candidate', candidate, candidateKwargs or {})]:
+        sourceDir = get_source(version, workDir, f"{name}_source")
+        outputDirs[name] = os.path.join(workDir, f"{name}_output")
+        shutil.rmtree(outputDirs[name], ignore_errors=True)
+        os.makedirs(outputDirs[name])
+        command = ("import sys, json; sys.path.insert(0, sys.argv[1]); import golden; "
+                   "golden.run_version(sys.argv[2], sys.argv[3], "
+                   "json.loads(sys.argv[4]), json.loads(sys.argv[5]))")
+        subprocess.run([sys.executable, '-c', command, os.path.dirname(os.path.abspath(__file__)),
+                        sourceDir, outputDirs[name], json.dumps(mainArgs), json.dumps(kwargs)],
+                       check=True, stdout=subprocess.DEVNULL)
+
+    results = {}
+    for name, outputDir in outputDirs.items():
+        with open(os.path.join(outputDir, 'frames.pkl'), 'rb') as f:
+            results[name] = pickle.load(f)
+    diffs, notes = compare_frames(results['legacy'], results['candidate'], names, rtol, atol)
+    workbookDiffs, workbookNotes = compare_workbooks(outputDirs['legacy'], outputDirs['candidate'],
+                                                     rtol, atol)
+    return diffs + workbookDiffs, notes + workbookNotes
+
+def print_report(diffs, notes):
+    for note in notes:
+        print(f"Note: {note}")
+    for diff in diffs:
+        print(f"Diff: {diff}")
+    print("Outputs match" if not diffs else f"{len(diffs)} differences found")
+    return
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a legacy and a candidate version "
+                                     + "of the Stoplight on the same Jira exports and "
+                                     + "diffs the intermediate frames and workbook cells.")
+    parser.add_argument('newJiraFile',
+                        help='Path to current Jira export')
+    parser.add_argument('prevJiraFile',
+                        help='Path to previous Jira export')
+    parser.add_argument('baseJiraFile',
+                        help='Path to baseline Jira export')
+    parser.add_argument('PILookupFile',
+                        help='Path to PI Lookup file')
+    parser.add_argument('--sprint',
+                        help='INT: Current sprint',
+                        type=int,
+                        default=4)
+    parser.add_argument('--lastCompleteSprint',
+                        help='INT: Last complete sprint',
+                        type=int,
+                        default=3)
+    parser.add_argument('--PI',
+                        help='str: current PI',
+                        default='23.2')
+    parser.add_argument('--legacy',
+                        help='Git ref or directory of the legacy version. Default is the first commit')
+    parser.add_argument('--candidate',
+                        help='Git ref or directory of the candidate version. Default is the working tree')
+    parser.add_argument('--frames',
+                        help='Pivot attributes to compare',
+                        nargs='+',
+                        default=frames)
+    parser.add_argument('--rtol',
+                        help='FLOAT: Relative tolerance for numbers',
+                        type=float,
+                        default=1e-9)
+    parser.add_argument('--atol',
+                        help='FLOAT: Absolute tolerance for numbers',
+                        type=float,
+                        default=1e-9)
+    parser.add_argument('--compact',
+                        help='Flag to run the candidate with --compact',
+                        action=argparse.BooleanOptionalAction)
+    parser.add_argument('--jobs',
+                        help='INT: Number of processes for the candidate',
+                        type=int,
+                        default=1)
+    parser.add_argument('--streamExport',
+                        help='Flag to run the candidate with --streamExport',
+                        action=argparse.BooleanOptionalAction)
+    args = parser.parse_args()
+
+    diffs, notes = check([args.newJiraFile, args.prevJiraFile, args.baseJiraFile],
+                         args.PILookupFile, args.sprint, args.lastCompleteSprint, args.PI,
+                         args.legacy, args.candidate,
+                         {'compact': args.compact, 'jobs': args.jobs,
+                          'streamExport': args.streamExport},
+                         args.frames, args.rtol, args.atol)
+    print_report(diffs, notes)
+    if diffs:
+        sys.exit(1)
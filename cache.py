@@ -0,0 +1,68 @@
+# On-disk cache of parsed and derived Jira exports, keyed by file contents
+
+import hashlib
+import os
+import tempfile
+import pandas as pd
+
+# Bump when clean_data/set_attributes change so stale derived frames are ignored
+CACHE_VERSION = 1
+
+def file_hash(path):
+    """Return the sha256 hex digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def source_hash(source):
+    """Hash of a path's contents or of bytes, None for a DataFrame, which is not cached"""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    if isinstance(source, (str, os.PathLike)):
+        return file_hash(source)
+    return None
+
+def get_key(*parts):
+    """Combine hashes and settings into a single cache key"""
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+def load(cacheDir, name, key):
+    """Return the cached frame for key, or None if it is not cached"""
+    if cacheDir is None:
+        return None
+    for ext, reader in (('parquet', pd.read_parquet), ('pkl', pd.read_pickle)):
+        path = os.path.join(cacheDir, f"{name}_{key}.{ext}")
+        if os.path.exists(path):
+            try:
+                return reader(path)
+            except Exception:
+                # Unreadable entry (partial write, missing engine), rebuild it
+                return None
+    return None
+
+def save(cacheDir, name, key, df):
+    """Write df to the cache as Parquet, falling back to pickle"""
+    if cacheDir is None:
+        return
+    os.makedirs(cacheDir, exist_ok=True)
+    path = os.path.join(cacheDir, f"{name}_{key}")
+    # A temp file of its own, as other processes may save the same key
+    fd, tmpPath = tempfile.mkstemp(dir=cacheDir, suffix='.tmp')
+    os.close(fd)
+    try:
+        try:
+            df.to_parquet(tmpPath, index=False)
+            # Only keep Parquet if it round trips without changing the frame
+            if pd.read_parquet(tmpPath).equals(df.reset_index(drop=True)):
+                os.replace(tmpPath, f"{path}.parquet")
+                return
+        except Exception:
+            # pyarrow not installed or mixed-type columns Parquet cannot store
+            pass
+        df.to_pickle(tmpPath)
+        os.replace(tmpPath, f"{path}.pkl")
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
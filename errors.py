@@ -0,0 +1,23 @@
+# Errors raised for invalid Jira exports and calendar files. The command
+# line prints the message and exits; library callers can catch them
+
+class StoplightError(Exception):
+    """Base class for errors in the Stoplight inputs"""
+
+class EmptyExportError(StoplightError):
+    """A Jira export has no rows"""
+
+class InvalidIndexError(StoplightError):
+    """A Jira export has a missing or invalid Index"""
+
+class InvalidDateError(StoplightError):
+    """A Jira export has an invalid Planned Start Date"""
+
+class EmptyPIError(StoplightError):
+    """None of the Jira exports have stories in a PI"""
+
+class ThresholdError(StoplightError):
+    """The yellow stoplight threshold is not above the red one"""
+
+class CalendarError(StoplightError):
+    """The PI Lookup or Sprints file is missing columns or has invalid dates"""
@@ -0,0 +1,51 @@
+# Monte Carlo forecast of the sprints needed to finish the remaining points,
+# resampling the points completed in each past sprint
+
+import numpy as np
+
+columns = ['P50 Sprints', 'P85 Sprints', 'Chance Done by PI End']
+
+def sprints_needed(history, pointsRem, groups=None, trials=10000, horizon=60, seed=0):
+    """Sprints each trial needs to complete pointsRem, as a trials x series array
+
+    history is series x sprints of points completed in each past sprint, and
+    every trial draws one past sprint per series per future sprint. groups is
+    an optional series x groups 0/1 matrix; each group is forecast from the
+    sum of its series' draws, so a CLIN uses the same draws as its epics.
+    Trials that have not finished within horizon sprints are inf, and NaN
+    if there is no history to draw from.
+    """
+    history = np.asarray(history, dtype=float)
+    pointsRem = np.asarray(pointsRem, dtype=float)
+    if groups is not None:
+        pointsRem = np.concatenate([pointsRem, pointsRem @ groups])
+    needed = np.full((trials, pointsRem.shape[0]), np.inf)
+    needed[:, pointsRem <= 0] = 0
+    if history.shape[1] == 0:
+        needed[np.isinf(needed)] = np.nan
+        return needed
+
+    rng = np.random.default_rng(seed)
+    series = np.arange(history.shape[0])
+    completed = np.zeros(needed.shape)
+    for sprint in range(1, horizon + 1):
+        if np.isfinite(needed).all():
+            break
+        draws = history[series, rng.integers(0, history.shape[1], (trials, history.shape[0]))]
+        if groups is not None:
+            draws = np.concatenate([draws, draws @ groups], axis=1)
+        completed += draws
+        needed[np.isinf(needed) & (completed >= pointsRem)] = sprint
+    return needed
+
+def summarize(needed, sprintsLeft):
+    """P50 and P85 sprints needed and the share of trials done within sprintsLeft
+
+    The percentiles are NaN when that share of trials never finishes, and
+    all three are NaN for a series without history.
+    """
+    percentiles = np.percentile(needed, [50, 85], axis=0, method='inverted_cdf')
+    percentiles[np.isinf(percentiles)] = np.nan
+    chance = (needed <= sprintsLeft).mean(axis=0)
+    chance[np.isnan(needed).any(axis=0)] = np.nan
+    return np.column_stack([percentiles[0], percentiles[1], chance])
@@ -0,0 +1,87 @@
+# Per-stage wall time, CPU time, peak memory and row counts
+
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+# Columns of the text report
+columns = ['Stage', 'Snapshot', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Rows']
+
+def get_peak_rss():
+    """Peak resident memory of this process in MB, None if unavailable"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS and kilobytes on Linux
+        return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2**20
+    except (ImportError, AttributeError):
+        return None
+
+@contextmanager
+def stage(records, name, snapshot=None, rows=None):
+    """Time the enclosed block and append its record to records
+
+    rows can be a function, called when the block ends, that returns the
+    number of rows the stage worked on. It is not called if the block
+    raises. The block can rename the stage through the yielded record.
+    """
+    record = {'Stage': name, 'Snapshot': snapshot}
+    wallStart = time.perf_counter()
+    cpuStart = time.process_time()
+    completed = False
+    try:
+        yield record
+        completed = True
+    finally:
+        record['Wall (s)'] = round(time.perf_counter() - wallStart, 4)
+        record['CPU (s)'] = round(time.process_time() - cpuStart, 4)
+        peak = get_peak_rss()
+        record['Peak RSS (MB)'] = None if peak is None else round(peak, 1)
+        if callable(rows):
+            rows = rows() if completed else None
+        record['Rows'] = rows
+        records.append(record)
+
+def get_export_rows(self, *args, **kwargs):
+    """Rows of the pivot's Jira export, None before it is read"""
+    return None if getattr(self, 'JiraDf', None) is None else len(self.JiraDf)
+
+def profile_stage(name, rows=get_export_rows):
+    """Decorator recording a Pivot method as a stage of that pivot's profile
+
+    rows is called with the method's arguments after it returns and gives
+    the number of rows the stage worked on. The default is the export size.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not hasattr(self, 'profile'):
+                self.profile = []
+            with stage(self.profile, name, getattr(self, 'jira', None),
+                       lambda: rows(self, *args, **kwargs)):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+def write_report(records, outputDir, name='profile', columns=columns):
+    """Write records as JSON and as a text table to outputDir"""
+    with open(os.path.join(outputDir, f"{name}.json"), 'w') as f:
+        json.dump(records, f, indent=2)
+
+    table = [columns] + [['' if record.get(col) is None else str(record.get(col))
+                          for col in columns] for record in records]
+    widths = [max(len(row[i]) for row in table) for i in range(len(columns))]
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+             for row in table]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    with open(os.path.join(outputDir, f"{name}.txt"), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return